@@ -41,3 +41,10 @@ class BaseAPIObject(ObjectifiedDict, Model):
     @property
     def valid(self):
         return all(map(lambda key:self.__contains__(key), self.REQUIRED_FIELDS))
+    
+    @classmethod
+    def from_db_values(cls, data: dict) -> 'BaseAPIObject':
+        """API objects keep their values as dictionary items instead of attributes."""
+        obj = cls(data)
+        obj.mark_saved(data)
+        return obj
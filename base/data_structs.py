@@ -69,7 +69,7 @@ class ProgressInfo(ObjectifiedDict):
         self.time_info: Timer
     
     def __bool__(self):
-        return self.stream.ok
+        return self.stream.ok if self.stream is not None else self.get('from_cache', False)
     
     @property
     def finished(self):
@@ -1,5 +1,9 @@
 
+from .async_manager import AsyncSQLiteDB
+from .cache import ModelCache
 from .cursor import CursorProxy, CursorTask
-from .manager import SQLiteDB, MultiThreadedSQLiteDB
+from .manager import SQLiteDB, MultiThreadedSQLiteDB, ShardedSQLiteDB
+from .pragmas import PRAGMA_PRESETS
+from .profiler import QueryProfiler
 
 from .models import *
@@ -0,0 +1,238 @@
+import asyncio
+from contextlib import nullcontext
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from .manager import BaseManager, SQLiteDB
+from .models.base import Model, ModelMeta
+from .models.statement import Statement
+from .pool import ReaderPool
+
+
+class AsyncSQLiteDB(BaseManager):
+    """
+    An asyncio manager, its methods are awaitable and get is an async iterator. Model shorthands such as Beatmap.get and
+    Beatmap.count return awaitables and async iterators too once it is registered.
+    
+    A MANAGER_CLASS manager runs the writes on a dedicated writer thread, so models, converters and statement compilation
+    are the sync manager's. Reads run on reader threads with a ReaderPool, unless batched writes are pending, then they
+    run on the writer thread, which sees them. Every call is an asyncio future of a thread's work, the event loop never blocks.
+    Reads beyond the pool's size wait on the event loop for a connection to be released.
+    
+    The database is connected to and its schema created by await db.open(), or by async with db, before any other call.
+    """
+    TABLES: List[ModelMeta] = []
+    REGISTER_AS_MODEL_DB = True
+    MANAGER_CLASS = SQLiteDB
+    PRAGMAS = 'durable' # WAL, so readers are not blocked by the writer
+    READER_POOL_SIZE = 4
+    
+    _repr_format = "<%(classname)s Manager>"
+    
+    def __init__(self, database: str, *, reader_pool_size: int = None, **manager_kwargs):
+        self.reader_pool_size = reader_pool_size if reader_pool_size is not None else self.__class__.READER_POOL_SIZE
+        self.manager_kwargs = dict(manager_kwargs)
+        self.manager_kwargs.setdefault('pragmas', self.__class__.PRAGMAS)
+        
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncSQLiteDB Writer')
+        self._readers = ThreadPoolExecutor(max_workers=max(self.reader_pool_size, 1), thread_name_prefix='AsyncSQLiteDB Reader')
+        self.manager: Optional[SQLiteDB] = None # Set by open
+        self.reader_pool: Optional[ReaderPool] = None
+        self._reader_slots: Optional[asyncio.Semaphore] = None
+        super().__init__(database, initialize=False)
+    
+    async def open(self) -> 'AsyncSQLiteDB':
+        """Connects and creates the schema on the writer thread, then registers the manager for the model shorthands. Opens once."""
+        if self.manager is not None:
+            return self
+        manager_class = type('Sync'+self.__class__.MANAGER_CLASS.__name__, (self.__class__.MANAGER_CLASS,), dict(TABLES=self.__class__.TABLES, REGISTER_AS_MODEL_DB=False))
+        # Created on the writer thread, which owns the manager's connection from then on
+        manager = await self.write(manager_class, self.database, initialize=False, **self.manager_kwargs)
+        await self.write(manager._init)
+        self.reader_pool = (ReaderPool(self.database, self.reader_pool_size, manager.pragmas, manager.row_factory, connect_kwargs=manager.get_connect_kwargs())
+                            if self.reader_pool_size > 0 and ReaderPool.supports(self.database) else None)
+        # Held by every read of the pool while it holds a connection, streams included, so reader threads never wait in acquire
+        self._reader_slots = asyncio.Semaphore(max(self.reader_pool_size, 1))
+        self.manager = manager
+        if self.__class__.REGISTER_AS_MODEL_DB:
+            for table in self.__class__.TABLES:
+                table.register_db_manager(self)
+        return self
+    
+    async def __aenter__(self):
+        return await self.open()
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    @staticmethod
+    def run_in(executor: Executor, func: Callable, *args, **kwargs) -> 'asyncio.Future':
+        return asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+    
+    def write(self, func: Callable, *args, **kwargs) -> 'asyncio.Future':
+        """Runs func on the writer thread, e.g. await db.write(db.manager.transaction_work)."""
+        return self.run_in(self._writer, func, *args, **kwargs)
+    
+    def get_read_executor(self) -> Executor:
+        "Reads go to the writer thread while the pool can not see its uncommitted writes."
+        use_pool = self.reader_pool is not None and self.manager._pending_rows == 0 and self.manager._transaction_depth == 0
+        return self._readers if use_pool else self._writer
+    
+    def _fetchall(self, select_query: str, parameters=()) -> List[dict]:
+        with self.reader_pool.connection() as connection:
+            return connection.execute(select_query, parameters).fetchall()
+    
+    def _select_scalar(self, select_query: str, parameters=()):
+        with self.reader_pool.connection() as connection:
+            batches = self.manager._iter_cursor_batches(connection.cursor(), select_query, parameters, 1, True)
+            try:
+                for _, rows in batches:
+                    return rows[0][0]
+            finally:
+                batches.close()
+    
+    async def read(self, func: Callable, *args, **kwargs):
+        """Runs func, which uses a connection of the pool, on a reader thread once a connection is free."""
+        async with self._reader_slots:
+            return await self.run_in(self._readers, func, *args, **kwargs)
+    
+    async def select(self, select_query: str, parameters=()) -> List[dict]:
+        executor = self.get_read_executor()
+        if executor is self._writer:
+            return await self.run_in(executor, self.manager.select, select_query, parameters)
+        return await self.read(self._fetchall, select_query, parameters)
+    
+    async def iter_select_batches(self, select_query: str, parameters=(), arraysize: int = None, raw: bool = False) -> AsyncIterator[Tuple[Tuple[str, ...], list]]:
+        """Streams (columns, rows) batches of a query, each batch is fetched by a thread while the event loop runs."""
+        arraysize = arraysize or self.manager.FETCH_ARRAYSIZE
+        executor = self.get_read_executor()
+        async with self._reader_slots if executor is self._readers else nullcontext(): # The slot is held as long as the connection
+            connection = await self.run_in(executor, self.reader_pool.acquire) if executor is self._readers else None
+            try:
+                batches = await self.run_in(executor, lambda: self.manager._iter_cursor_batches((connection or self.manager.connection).cursor(), select_query, parameters, arraysize, raw))
+                try:
+                    while True:
+                        batch = await self.run_in(executor, next, batches, None)
+                        if batch is None:
+                            break
+                        yield batch
+                finally:
+                    # The suspended generator only closes its cursor, which a pool connection allows from any thread
+                    await self.run_in(executor, batches.close) if executor is self._writer else batches.close()
+            finally:
+                self.reader_pool.release(connection) if connection is not None else None
+    
+    async def get(self, model: Model, comparators=None, **kwargs) -> AsyncIterator[Model]:
+        model = model.__class__ if isinstance(model, Model) else model
+        select_query = model.make_select_query(comparators, **kwargs)
+        async for columns, rows in self.iter_select_batches(*select_query.compile(), raw=True):
+            for obj in map(model.make_row_converter(columns), rows):
+                yield obj
+    
+    def get_all(self, model: Model) -> AsyncIterator[Model]:
+        return self.get(model)
+    
+    async def search(self, model: Model, query: str, limit: int = None) -> AsyncIterator[Model]:
+        """Like SQLiteDB.search, streams the instances matching an FTS5 query, best ranked first."""
+        model = model.__class__ if isinstance(model, Model) else model
+        if len(model.get_fulltext_fields()) == 0:
+            raise RuntimeError("Model '{}' has no fulltext fields to search.".format(model.__name__))
+        parameters = (query, limit) if limit is not None else (query,)
+        async for columns, rows in self.iter_select_batches(model.make_search_query(limit=limit is not None), parameters, raw=True):
+            for obj in map(model.make_row_converter(columns), rows):
+                yield obj
+    
+    async def iter_pages(self, model: Model, comparators=None, order_by=None, page_size: int = 1000) -> AsyncIterator[List[Model]]:
+        """Like SQLiteDB.iter_pages, yields lists of up to page_size instances with keyset pagination."""
+        model = model.__class__ if isinstance(model, Model) else model
+        orderers = model.make_page_orderers(order_by)
+        after = None
+        while True:
+            page, last_row = [], None
+            async for columns, rows in self.iter_select_batches(*model.make_page_query(comparators, orderers, page_size, after).compile(), raw=True):
+                page.extend(map(model.make_row_converter(columns), rows))
+                last_row = dict(zip(columns, rows[-1]))
+            if len(page) > 0:
+                yield page
+            if len(page) < page_size:
+                return
+            after = tuple(last_row[column] for column, _ in orderers)
+    
+    async def values(self, model: Model, columns: list, comparators=None, **kwargs) -> AsyncIterator[tuple]:
+        """Like SQLiteDB.values, streams tuples of the given columns."""
+        model = model.__class__ if isinstance(model, Model) else model
+        select_query = model.make_select_query(comparators, columns=columns, **kwargs)
+        async for names, rows in self.iter_select_batches(*select_query.compile(), raw=True):
+            converter = model.make_values_converter(names)
+            for row in (map(converter, rows) if converter is not None else rows):
+                yield row
+    
+    def _fetch_columns(self, select_query: str, parameters, model: Optional[ModelMeta]) -> Dict[str, Any]:
+        with self.reader_pool.connection() as connection:
+            return self.manager.make_columns(self.manager._iter_cursor_batches(connection.cursor(), select_query, parameters, self.manager.FETCH_ARRAYSIZE, True), model)
+    
+    async def fetch_columns(self, query: Union[Statement, str], parameters=(), model: Union[ModelMeta, Model] = None) -> Dict[str, Any]:
+        """Like SQLiteDB.fetch_columns, the columns are packed by the thread running the query."""
+        if self.get_read_executor() is self._writer:
+            return await self.run_in(self._writer, self.manager.fetch_columns, query, parameters, model)
+        if isinstance(query, Statement):
+            model = model if model is not None else next((table for table in self.__class__.TABLES if table.table_name == getattr(query, 'table_name', None)), None)
+            query, parameters = query.compile()
+        return await self.read(self._fetch_columns, query, parameters, model)
+    
+    async def select_scalar(self, select_query: str, parameters=()):
+        """First column of the first row of a query, None if it returns no rows."""
+        executor = self.get_read_executor()
+        if executor is self._writer:
+            return await self.run_in(executor, self.manager.select_scalar, select_query, parameters)
+        return await self.read(self._select_scalar, select_query, parameters)
+    
+    async def count(self, model: Model, comparators=None) -> int:
+        model = model.__class__ if isinstance(model, Model) else model
+        return await self.select_scalar(*model.make_count_query(comparators).compile())
+    
+    async def exists(self, model: Model, comparators=None) -> bool:
+        model = model.__class__ if isinstance(model, Model) else model
+        return bool(await self.select_scalar(*model.make_exists_query(comparators).compile()))
+    
+    async def create_table(self, model: Union[ModelMeta, Model]):
+        return await self.write(self.manager.create_table, model)
+    
+    async def drop_table(self, model: Union[ModelMeta, Model]):
+        return await self.write(self.manager.drop_table, model)
+    
+    async def insert(self, obj: Model, **insertKwargs):
+        return await self.write(self.manager.insert, obj, **insertKwargs)
+    
+    async def upsert(self, obj: Model):
+        return await self.write(self.manager.upsert, obj)
+    
+    async def save(self, obj: Model) -> bool:
+        return await self.write(self.manager.save, obj)
+    
+    async def insert_many(self, objs: Union[Iterable[Model], AsyncIterator[Model]], **insertKwargs) -> int:
+        """Like SQLiteDB.insert_many, async iterables are consumed on the event loop and written a chunk at a time."""
+        if not hasattr(objs, '__aiter__'):
+            return await self.write(self.manager.insert_many, objs, **insertKwargs)
+        rows = 0
+        chunk = []
+        async for obj in objs:
+            chunk.append(obj)
+            if len(chunk) >= self.manager.INSERT_MANY_CHUNK_SIZE:
+                rows += await self.write(self.manager.insert_many, chunk, **insertKwargs)
+                chunk = []
+        rows += await self.write(self.manager.insert_many, chunk, **insertKwargs) if len(chunk) > 0 else 0
+        return rows
+    
+    async def delete(self, model: Model, comparators=None):
+        return await self.write(self.manager.delete, model, comparators)
+    
+    async def flush(self):
+        return await self.write(self.manager.flush)
+    
+    async def close(self):
+        await self.write(self.manager.close) if self.manager is not None else None
+        self.reader_pool.close() if self.reader_pool is not None else None
+        self._writer.shutdown()
+        self._readers.shutdown()
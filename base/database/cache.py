@@ -0,0 +1,176 @@
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from .models.base import Model, ModelMeta
+from .models.statement import AND, Comparator
+
+
+class ModelCache:
+    """
+    An identity map of model instances keyed by (model, primary key value), evicting the least recently used entries over size.
+    
+    A cached instance is shared by every lookup of its key. SQLiteDB.get only serves it while it has no unsaved changes, 
+    so changes made by one caller are not seen by the others before they are saved.
+    """
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._entries: 'OrderedDict[Tuple[ModelMeta, Hashable], Model]' = OrderedDict()
+        self._lock = Lock()
+    
+    def __repr__(self):
+        return "<{} object size={} entries={} hits={} misses={}>".format(self.__class__.__name__, self.size, len(self._entries), self.hits, self.misses)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def make_key(model: ModelMeta, obj: Model) -> Optional[Tuple[ModelMeta, Hashable]]:
+        """Key of an instance by its primary key as stored in the database, None for models without a single column primary key."""
+        primary_key_fields = model.get_primary_key_fields()
+        if len(primary_key_fields) != 1:
+            return None
+        (name, field), = primary_key_fields.items()
+        try:
+            return (model, field.convert_value(obj[name]))
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    @staticmethod
+    def make_lookup_key(model: ModelMeta, comparator) -> Optional[Tuple[ModelMeta, Hashable]]:
+        """Key of a query for one row by its primary key such as Beatmap.beatmap_id == x, None for any other query."""
+        if isinstance(comparator, AND) and len(comparator.statements) == 1:
+            comparator = comparator.statements[0]
+        primary_key_fields = model.get_primary_key_fields()
+        if not isinstance(comparator, Comparator) or comparator.op not in ['==', '='] or comparator.value is None or len(primary_key_fields) != 1:
+            return None
+        field, = primary_key_fields.values()
+        return (model, comparator.value) if comparator.name == field.name else None
+    
+    def get(self, key: Tuple[ModelMeta, Hashable]) -> Optional[Model]:
+        with self._lock:
+            obj = self._entries.get(key)
+            if obj is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return obj
+    
+    def put(self, key: Tuple[ModelMeta, Hashable], obj: Model):
+        with self._lock:
+            self._entries[key] = obj
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, key: Optional[Tuple[ModelMeta, Hashable]]):
+        if key is None:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def invalidate_model(self, model: ModelMeta):
+        """Drops every entry of a model, for writes whose affected rows are unknown such as deletes."""
+        with self._lock:
+            [self._entries.pop(key) for key in [key for key in self._entries if key[0] is model]]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return dict(size=self.size, entries=len(self._entries), hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hit_ratio=self.hits/lookups if lookups > 0 else 0.0)
+
+
+class QueryCache:
+    """
+    Results of select queries keyed by their SQL and parameters, evicting the least recently used entries over size.
+    
+    Every table has a version counter bumped by writes to it. An entry remembers the versions of the tables its query reads 
+    as of before the query ran, and is only served while none of them changed. Results over max_rows rows are not cached.
+    """
+    TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN|INTO|UPDATE)\s+["`\[]?(\w+)', re.IGNORECASE) # Tables read by selects, or written by INSERT, UPDATE and DELETE
+    
+    def __init__(self, size: int = 256, max_rows: int = 10000):
+        self.size = size
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._versions: Dict[str, int] = {}
+        self._entries: 'OrderedDict[Tuple[str, tuple], Tuple[Tuple[Tuple[str, int], ...], list]]' = OrderedDict()
+        self._lock = Lock()
+    
+    def __repr__(self):
+        return "<{} object size={} entries={} hits={} misses={}>".format(self.__class__.__name__, self.size, len(self._entries), self.hits, self.misses)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def make_key(select_query: str, parameters=()) -> Optional[Tuple[str, Hashable]]:
+        """None if the parameters are not hashable."""
+        key = (select_query, tuple(sorted(parameters.items())) if isinstance(parameters, dict) else tuple(parameters))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+    
+    @classmethod
+    @lru_cache(maxsize=1024)
+    def get_tables(cls, select_query: str) -> Tuple[str, ...]:
+        return tuple(sorted({table.lower() for table in cls.TABLE_PATTERN.findall(select_query)}))
+    
+    def get_versions(self, select_query: str) -> Tuple[Tuple[str, int], ...]:
+        """Versions of the tables read by a query, taken before running it and passed to put."""
+        with self._lock:
+            return tuple((table, self._versions.get(table, 0)) for table in self.get_tables(select_query))
+    
+    def bump(self, table_name: str):
+        """Invalidates the cached results reading a table, called on every write to it."""
+        with self._lock:
+            table_name = table_name.lower()
+            self._versions[table_name] = self._versions.get(table_name, 0) + 1
+    
+    def get(self, key: Tuple[str, Hashable]) -> Optional[list]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or any(self._versions.get(table, 0) != version for table, version in entry[0]):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+    
+    def put(self, key: Tuple[str, Hashable], versions: Tuple[Tuple[str, int], ...], rows: list):
+        if len(rows) > self.max_rows:
+            return
+        with self._lock:
+            self._entries[key] = (versions, list(rows))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """Drops every entry, for writes whose tables are unknown."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return dict(size=self.size, entries=len(self._entries), hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hit_ratio=self.hits/lookups if lookups > 0 else 0.0)
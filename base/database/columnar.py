@@ -0,0 +1,58 @@
+from array import array
+from typing import Any, Optional, Sequence, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ColumnBuffer:
+    """
+    Values of one result column, packed in an array.array of typecode, or in a list for other columns such as TEXT.
+    
+    Without a typecode it is inferred from the first values. NULL has no integer representation, so integer columns
+    containing NULL become float columns with NaN, and columns with values of other types become lists.
+    """
+    NUMPY_DTYPES = {'q': 'int64', 'd': 'float64', 'b': 'int8'}
+    
+    def __init__(self, typecode: Optional[str] = None):
+        self.typecode = typecode
+        self.values: Union[array, list] = array(typecode) if typecode is not None else []
+    
+    def __repr__(self):
+        return "<{} object typecode={} length={}>".format(self.__class__.__name__, self.typecode, len(self.values))
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def promote(self, typecode: Optional[str]):
+        self.values = array(typecode, self.values) if typecode is not None else list(self.values)
+        self.typecode = typecode
+    
+    def extend(self, values: Sequence[Any]):
+        if self.typecode is None and len(self.values) == 0:
+            first = next((value for value in values if value is not None), None)
+            self.promote('q' if isinstance(first, int) and not isinstance(first, bool) else 'd' if isinstance(first, float) else None)
+        if self.typecode is None:
+            self.values.extend(values)
+            return
+        
+        if None in values:
+            self.promote('d') if self.typecode != 'd' else None
+            values = [float('nan') if value is None else value for value in values]
+        try:
+            batch = array(self.typecode, values) # Built apart, as array.extend keeps the values before a failing one
+        except (TypeError, OverflowError):
+            self.promote('d' if all(isinstance(value, (int, float)) for value in values) and self.typecode != 'd' else None)
+            return self.extend(values) if self.typecode is not None else self.values.extend(values)
+        self.values.extend(batch)
+    
+    def to_array(self) -> Any:
+        """A NumPy array of the values if NumPy is installed, else the array.array or list itself."""
+        if numpy is None:
+            return self.values
+        if self.typecode is None:
+            return numpy.array(self.values, dtype=object)
+        values = numpy.frombuffer(self.values, dtype=self.NUMPY_DTYPES[self.typecode]) if len(self.values) > 0 else numpy.array([], dtype=self.NUMPY_DTYPES[self.typecode])
+        return values.astype(bool) if self.typecode == 'b' else values
@@ -1,30 +1,46 @@
-from queue import Queue
+import asyncio
+from concurrent.futures import Future, wait as futures_wait
+from queue import Empty, Queue
 import sqlite3
-from threading import Thread
-from typing import Any, Tuple, Union
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
 
+from .pragmas import connect
 
-class CursorTask:
-    """A CursorTask object, using Queue to block until result is available"""
-    def __init__(self, target_method: str, args: tuple, kwargs: dict):
+
+class CursorTask(Future):
+    """
+    A CursorTask object, a concurrent.futures.Future of the proxied call's return value.
+    Exceptions of the call are raised by get_result, and tasks can be awaited from asyncio code.
+    """
+    def __init__(self, target_method: Union[str, Callable], args: tuple, kwargs: dict):
+        super().__init__()
         self.target_method = target_method
         self.args = args
         self.kwargs = kwargs
-        self.result_q = Queue()
-        self.done = False
+    
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+    
+    def wait(self, timeout=None) -> bool:
+        """Blocks until the task is executed without taking its result."""
+        return len(futures_wait([self], timeout=timeout).done) > 0
     
     def get_result(self, block=True, timeout=None) -> Any:
-        """Calls result_q.get"""
-        if self.done:
-            return
-        rv = self.result_q.get(block=block, timeout=timeout)
-        self.done = True
-        return rv
+        """Returns the call's return value or raises its exception, could be called any number of times."""
+        return self.result(timeout=timeout if block else 0)
 
 
 class CursorProxy:
-    def __init__(self, database: str, cursor: sqlite3.Cursor = None, initialize: bool = True):
+    GROUP_COMMIT_MAX_TASKS = 256 # Most tasks taken from the queue at once and committed together
+    TRANSACTION_CONTROL_STATEMENTS = ('BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'VACUUM', 'ATTACH', 'DETACH')
+    
+    def __init__(self, database: str, cursor: sqlite3.Cursor = None, initialize: bool = True, pragmas: Union[str, Dict[str, Union[str, int]], None] = None, group_commit: bool = True, 
+                 connect_kwargs: dict = None):
         self.database = database
+        self.pragmas = pragmas
+        self.connect_kwargs = connect_kwargs if connect_kwargs is not None else {} # Passed to sqlite3.connect, e.g. a profiling factory
+        self.group_commit = group_commit
         self.connection: sqlite3.Connection = None
         self.cursor: sqlite3.Cursor = cursor
         
@@ -32,13 +48,15 @@ class CursorProxy:
         self.proxy_cursor: sqlite3.Cursor = None
         self.daemon: Thread = Thread(target=self.process_queued_tasks, name='CursorProxy Daemon Thread', daemon=True)
         self.queue: Queue = Queue()
+        self.last_task: CursorTask = None
+        self._enqueue_lock = Lock()
         
         self._proxy_map = {}
         
         if cursor is not None:
             self.connection = self.cursor.connection
         else:
-            self.connection = sqlite3.connect(self.database)
+            self.connection = connect(self.database, self.pragmas, **self.connect_kwargs)
             self.cursor = self.connection.cursor()
         
         if initialize:
@@ -61,33 +79,139 @@ class CursorProxy:
     
     def process_queued_tasks(self):
         try:
-            self.proxy_connection = sqlite3.connect(self.database)
+            self.proxy_connection = connect(self.database, self.pragmas, **self.connect_kwargs)
             self.proxy_connection.row_factory = self.connection.row_factory
             self.proxy_cursor = self.proxy_connection.cursor()
             while True:
-                task = None
+                tasks = self.queue.get(True) # Queue entries are lists of tasks, see submit_many
+                while len(tasks) < self.GROUP_COMMIT_MAX_TASKS:
+                    try:
+                        tasks = tasks + self.queue.get_nowait()
+                    except Empty:
+                        break
+                tasks = [task for task in tasks if task.set_running_or_notify_cancel()]
                 try:
-                    task: CursorTask = self.queue.get(True)
-                    res = None
-                    if task.target_method.__contains__('.'):
-                        method = self.proxy_cursor
-                        for accessor in task.target_method.split('.'):
-                            method = method.__getattribute__(accessor)
-                        res = method(*task.args, **task.kwargs)
-                    else:
-                        res = self.proxy_cursor.__getattribute__(task.target_method)(*task.args, **task.kwargs)
-                    task.result_q.put(res)
-                except Exception as exc:
-                    if task is not None:
-                        task.result_q.put(exc)
+                    self.process_tasks(tasks)
+                except Exception as exc: # Delivered to the tasks left, the daemon keeps serving the queue
+                    [task.set_exception(exc) for task in tasks if not task.done()]
         finally:
             self.proxy_cursor.close()
     
-    def enqueue_task(self, method_name: str, args: Tuple, kwargs: dict):
+    def run_task(self, task: CursorTask) -> Any:
+        """Runs a task on the proxy cursor and returns its return value, exceptions are propagated."""
+        if callable(task.target_method):
+            return task.target_method(self.proxy_cursor, *task.args, **task.kwargs)
+        elif task.target_method.__contains__('.'):
+            method = self.proxy_cursor
+            for accessor in task.target_method.split('.'):
+                method = method.__getattribute__(accessor)
+            return method(*task.args, **task.kwargs)
+        return self.proxy_cursor.__getattribute__(task.target_method)(*task.args, **task.kwargs)
+    
+    @staticmethod
+    def deliver(task: CursorTask, result: Any):
+        if isinstance(result, Exception):
+            task.set_exception(result)
+        else:
+            task.set_result(result)
+    
+    @classmethod
+    def is_transaction_control(cls, task: CursorTask) -> bool:
+        """
+        Whether the task may end or change the transaction, so it can not run inside a group: statements such as BEGIN, COMMIT 
+        or PRAGMA, scripts, which commit first, and connection methods other than commit, e.g. connection.rollback.
+        """
+        if isinstance(task.target_method, str) and (task.target_method == 'executescript' or 
+                                                    (task.target_method.startswith('connection.') and task.target_method != 'connection.commit')):
+            return True
+        return (task.target_method == 'execute' and len(task.args) > 0 and isinstance(task.args[0], str) 
+                and task.args[0].lstrip().upper().startswith(cls.TRANSACTION_CONTROL_STATEMENTS))
+    
+    def process_tasks(self, tasks: List[CursorTask]):
+        """
+        Runs tasks in one transaction (group commit), each task in its own savepoint so a failing task does not roll back 
+        the others. commit tasks inside a group are merged into a single commit of the group, and results are delivered once 
+        it is committed. A group without commit tasks is left uncommitted like its writes would be without grouping.
+        Tasks are run one by one instead if a transaction is already open, e.g. by SQLiteDB.transaction.
+        """
+        group: List[Tuple[CursorTask, Any]] = []
+        grouping = False
+        for task in tasks:
+            transaction_control = self.is_transaction_control(task)
+            if grouping and transaction_control:
+                self.finish_group(group)
+                group, grouping = [], False
+            elif not grouping and not transaction_control and self.group_commit and len(tasks) > 1 and not self.proxy_connection.in_transaction:
+                self.proxy_connection.execute("BEGIN")
+                grouping = True
+            
+            if not grouping:
+                try:
+                    res = self.run_task(task)
+                except Exception as exc:
+                    res = exc
+                self.deliver(task, res)
+            elif task.target_method == 'connection.commit':
+                group.append((task, None))
+            else:
+                group.append((task, self.run_grouped_task(task)))
+                if not self.proxy_connection.in_transaction: # The task ended the group's transaction anyway
+                    self.finish_group(group)
+                    group, grouping = [], False
+        if grouping:
+            self.finish_group(group)
+    
+    def run_grouped_task(self, task: CursorTask) -> Any:
+        "Runs a task in a savepoint of the group, so if it fails only its own writes are rolled back."
+        res = None
+        try:
+            self.proxy_connection.execute("SAVEPOINT group_commit_task")
+            try:
+                res = self.run_task(task)
+            except Exception as exc:
+                res = exc
+                self.proxy_connection.execute("ROLLBACK TO group_commit_task")
+            self.proxy_connection.execute("RELEASE group_commit_task")
+        except sqlite3.Error as exc: # The savepoint is gone, e.g. the task ended the transaction
+            res = res if isinstance(res, Exception) else exc
+        return res
+    
+    def finish_group(self, group: List[Tuple[CursorTask, Any]]):
+        "Commits the group if it contains a commit task and delivers its results."
+        if self.proxy_connection.in_transaction and any(task.target_method == 'connection.commit' for task, _ in group):
+            try:
+                self.proxy_connection.commit()
+            except Exception as exc:
+                self.proxy_connection.rollback()
+                group = [(task, exc) for task, _ in group]
+        for task, res in group:
+            self.deliver(task, res)
+    
+    def enqueue_task(self, method_name: Union[str, Callable], args: Tuple, kwargs: dict):
         task = CursorTask(method_name, args, kwargs)
-        self.queue.put(task)
+        with self._enqueue_lock:
+            self.last_task = task
+            self.queue.put([task])
         return task
     
+    def submit_many(self, method_name: Union[str, Callable], args_list: Iterable[Tuple], kwargs: dict = None) -> List[CursorTask]:
+        """Queues a call of method_name for every args in args_list at once, they are run in order and in the same group commit where possible."""
+        kwargs = kwargs if kwargs is not None else {}
+        tasks = [CursorTask(method_name, args, kwargs) for args in args_list]
+        if len(tasks) > 0:
+            with self._enqueue_lock:
+                self.last_task = tasks[-1]
+                self.queue.put(tasks)
+        return tasks
+    
+    @staticmethod
+    def _noop(cursor: sqlite3.Cursor):
+        pass
+    
+    def wait_for_queued_tasks(self, timeout=None) -> bool:
+        """Blocks until every task queued so far is executed, by queueing a task behind them and waiting for it."""
+        return self.enqueue_task(self._noop, (), {}).wait(timeout)
+    
     def make_proxy(self, method_name: str):
         if not hasattr(self.cursor, method_name):
             raise AttributeError('\'{}\' is not found in this cursor object.'.format(method_name))
@@ -95,23 +219,56 @@ class CursorProxy:
             return self.proxy(method_name, *args, **kwargs)
         return _proxy
 
-    def proxy(self, method_name: str, *args, block: bool = False, **kwargs) -> Union[CursorTask, Any]:
+    def proxy(self, method_name: Union[str, Callable], *args, block: bool = False, **kwargs) -> Union[CursorTask, Any]:
         task = self.enqueue_task(method_name, args=args, kwargs=kwargs)
         if not block:
             return task
         return task.get_result(block=True)
     
     def blocking_proxy(self, method_name: str, *args, **kwargs) -> Any:
-        return self.proxy(method_name=method_name, *args, block=True, **kwargs)
+        return self.proxy(method_name, *args, block=True, **kwargs)
 
     def commit_proxy(self):
         return self.proxy('connection.commit')
     
+    @staticmethod
+    def _execute_and_fetchall(cursor: sqlite3.Cursor, *execute_args) -> List[Any]:
+        return cursor.execute(*execute_args).fetchall()
+    
+    def select(self, *execute_args) -> List[Any]:
+        """Executes a query and fetches its rows in a single task, so other threads' tasks can not run in between."""
+        return self.blocking_proxy(self._execute_and_fetchall, *execute_args)
+    
+    @staticmethod
+    def _open_cursor(cursor: sqlite3.Cursor, raw: bool, *execute_args) -> Tuple[sqlite3.Cursor, Tuple[str, ...]]:
+        new_cursor = cursor.connection.cursor()
+        if raw:
+            new_cursor.row_factory = None
+        new_cursor.execute(*execute_args)
+        return new_cursor, tuple(column[0] for column in new_cursor.description or ())
+    
+    def iter_select_batches(self, select_query: str, parameters=(), arraysize: int = 256, raw: bool = False) -> Iterator[Tuple[Tuple[str, ...], List[Any]]]:
+        """Streams (columns, rows) batches of a query arraysize rows at a time, on a cursor of its own in the daemon thread. Rows are plain tuples if raw."""
+        cursor, columns = self.blocking_proxy(self._open_cursor, raw, select_query, parameters)
+        try:
+            while True:
+                rows = self.blocking_proxy(lambda _, cursor=cursor: cursor.fetchmany(arraysize))
+                if not rows:
+                    break
+                yield columns, rows
+        finally:
+            self.proxy(lambda _, cursor=cursor: cursor.close())
+    
+    def iter_select(self, select_query: str, parameters=(), arraysize: int = 256) -> Iterator[Any]:
+        """Streams the rows of a query arraysize rows at a time, on a cursor of its own in the daemon thread."""
+        for _, rows in self.iter_select_batches(select_query, parameters, arraysize):
+            yield from rows
+    
     def fetchone(self, *args, **kwargs):
-        return self.blocking_proxy('fetchone', *args, *kwargs)
+        return self.blocking_proxy('fetchone', *args, **kwargs)
     
     def fetchmany(self, *args, **kwargs):
-        return self.blocking_proxy('fetchmany', *args, *kwargs)
+        return self.blocking_proxy('fetchmany', *args, **kwargs)
     
     def fetchall(self, *args, **kwargs):
-        return self.blocking_proxy('fetchall', *args, *kwargs)
+        return self.blocking_proxy('fetchall', *args, **kwargs)
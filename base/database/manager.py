@@ -1,11 +1,26 @@
 
+import heapq
+import itertools
+import os
 import sqlite3
-from typing import Iterator, List, Union
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from .models.base import Model, ModelMeta
+from .models.field import Field
+from .models.statement import AND, Comparator, Limit, Statement
 from ..helper.class_mixin import ReprMixin
 
-from .cursor import CursorProxy
+from .cache import ModelCache, QueryCache
+from .columnar import ColumnBuffer
+from .cursor import CursorProxy, CursorTask
+from .pool import ReaderPool
+from .pragmas import connect
+from .profiler import QueryProfiler
 
 
 class BaseManager(ReprMixin):
@@ -25,31 +40,171 @@ class BaseManager(ReprMixin):
 class SQLiteDB(BaseManager):
     TABLES: List[ModelMeta] = []
     REGISTER_AS_MODEL_DB = True
+    BATCH_COMMIT_ROWS = 1 # Writes are committed once this many rows are pending, 1 commits every write
+    BATCH_COMMIT_INTERVAL: Optional[float] = None # Writes are committed once the oldest pending write is this many seconds old, None to disable
+    BATCH_COMMIT_TIMER = False # Whether a timer thread commits a batch once its interval passed, needs a connection usable from any thread
+    PRAGMAS: Union[str, Dict[str, Union[str, int]], None] = None # A preset name from PRAGMA_PRESETS or a dictionary of pragmas, applied to every connection
+    FETCH_ARRAYSIZE = 256 # Rows fetched at once while streaming results, see iter_select
+    INSERT_MANY_CHUNK_SIZE = 1000 # Rows passed to each executemany call of insert_many
+    MODEL_CACHE_SIZE = 0 # Instances kept by the identity map serving primary key lookups of get, 0 to disable
+    QUERY_CACHE_SIZE = 0 # Results kept by the cache of select, 0 to disable
+    WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER', 'WITH') # Statements run by execute that clear the query cache
     
     _repr_format = "<%(classname)s Manager>"
     
-    def __init__(self, database: str, *, initialize: bool = True):
+    def __init__(self, database: str, *, initialize: bool = True, batch_commit_rows: int = None, batch_commit_interval: float = None, pragmas: Union[str, Dict[str, Union[str, int]], None] = None, 
+                 model_cache_size: int = None, query_cache_size: int = None, profiler: QueryProfiler = None):
         self.database = database
-        self.connection = sqlite3.connect(database=self.database)
+        self.pragmas = pragmas if pragmas is not None else self.__class__.PRAGMAS
+        self.profiler = profiler # Times every statement of the manager's connections, see QueryProfiler.report
+        self.connection = self.connect()
         self.connection.row_factory = self.row_factory
         self.cursor = self.connection.cursor()
         
+        self.batch_commit_rows = batch_commit_rows if batch_commit_rows is not None else self.__class__.BATCH_COMMIT_ROWS
+        self.batch_commit_interval = batch_commit_interval if batch_commit_interval is not None else self.__class__.BATCH_COMMIT_INTERVAL
+        self._batch_lock = threading.RLock()
+        self._pending_rows = 0
+        self._batch_started: Optional[float] = None
+        self._batch_timer: Optional[threading.Timer] = None
+        self._transaction_depth = 0
+        self._transaction_thread: Optional[int] = None # Ident of the thread running the open transaction
+        
+        model_cache_size = model_cache_size if model_cache_size is not None else self.__class__.MODEL_CACHE_SIZE
+        self.model_cache: Optional[ModelCache] = ModelCache(model_cache_size) if model_cache_size > 0 else None
+        query_cache_size = query_cache_size if query_cache_size is not None else self.__class__.QUERY_CACHE_SIZE
+        self.query_cache: Optional[QueryCache] = QueryCache(query_cache_size) if query_cache_size > 0 else None
+        
         if initialize:
             self._init()
     
+    def connect(self) -> sqlite3.Connection:
+        """Opens a new connection to the database with the manager's pragmas applied."""
+        return connect(self.database, self.pragmas, **self.get_connect_kwargs())
+    
+    def get_connect_kwargs(self) -> dict:
+        return dict(factory=self.profiler.connection_factory) if self.profiler is not None else {}
+    
     @staticmethod
     def row_factory(cursor, row) -> dict:
-        return {col[0]:row[i] for i, col in enumerate(cursor.description)}
+        return dict(zip([col[0] for col in cursor.description], row))
     
     def execute(self, *args, **kwargs):
+        self._statement_executed(args[0]) if len(args) > 0 else None
         return self.cursor.execute(*args, **kwargs)
     
     def executemany(self, *args, **kwargs):
+        self._statement_executed(args[0]) if len(args) > 0 else None
         return self.cursor.executemany(*args, **kwargs)
     
-    def commit(self):
+    def _statement_executed(self, statement: str):
+        """
+        Statements run directly may write to any table, so the query cache is cleared for them. Cached instances of the 
+        models whose tables they name are dropped, or every cached instance if they name none, such as DROP or ALTER.
+        """
+        if not isinstance(statement, str) or not statement.lstrip().upper().startswith(self.WRITE_STATEMENTS):
+            return
+        self.query_cache.clear() if self.query_cache is not None else None
+        if self.model_cache is not None:
+            tables = QueryCache.get_tables(statement)
+            models = [model for model in self.__class__.TABLES if model.table_name.lower() in tables]
+            [self.model_cache.invalidate_model(model) for model in models] if len(models) > 0 else self.model_cache.clear()
+    
+    def _tables_changed(self, *models: Union[ModelMeta, Model]):
+        "Invalidates the cached results reading the models' tables."
+        [self.query_cache.bump(model.table_name) for model in models] if self.query_cache is not None else None
+    
+    def commit(self, rows: int = 1):
+        """
+        Marks rows as written and commits them, unless a transaction is open or the batch is not full yet.
+        A batch is full once batch_commit_rows rows are pending or the oldest pending write is batch_commit_interval seconds old.
+        
+        With BATCH_COMMIT_TIMER a timer commits the batch once its interval passed, else the interval is only checked by 
+        later writes and reads of the manager, so the last writes of a burst may wait for one of them or for flush.
+        """
+        with self._batch_lock:
+            if self._transaction_depth > 0:
+                return
+            self._pending_rows += rows
+            if self._batch_started is None:
+                self._batch_started = time.monotonic()
+                self._start_batch_timer() if self.BATCH_COMMIT_TIMER and self.batch_commit_interval is not None and self._pending_rows < self.batch_commit_rows else None
+            if self._pending_rows >= self.batch_commit_rows:
+                return self.flush()
+            return self.flush_if_due()
+    
+    def flush_if_due(self):
+        """Commits the pending writes if the oldest of them is batch_commit_interval seconds old."""
+        with self._batch_lock:
+            if self._transaction_depth == 0 and self._batch_started is not None and self.batch_commit_interval is not None and time.monotonic()-self._batch_started >= self.batch_commit_interval:
+                return self.flush()
+    
+    def _start_batch_timer(self):
+        self._batch_timer = threading.Timer(self.batch_commit_interval, self._flush_batch_timer)
+        self._batch_timer.daemon = True
+        self._batch_timer.start()
+    
+    def _flush_batch_timer(self):
+        with self._batch_lock:
+            if threading.current_thread() is self._batch_timer and self._transaction_depth == 0: # Else its batch was flushed already
+                self.flush()
+    
+    def flush(self):
+        """Commits all pending writes now."""
+        with self._batch_lock:
+            self._pending_rows = 0
+            self._batch_started = None
+            self._batch_timer.cancel() if self._batch_timer is not None else None
+            self._batch_timer = None
+            return self.commit_connection()
+    
+    def commit_connection(self):
         return self.connection.commit()
     
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block in one transaction, committed on success and rolled back on exception.
+        Nested transactions use savepoints, so an inner failure only rolls back the inner block.
+        
+        The thread running the block holds the write lock until it ends, so writes of other threads wait for it instead of 
+        joining the transaction. The block must not wait for other threads writing to the manager.
+        """
+        with self._batch_lock:
+            depth = self._transaction_depth
+            if depth == 0:
+                self.flush()
+                self.execute("BEGIN")
+                self._transaction_thread = threading.get_ident()
+            else:
+                self.execute("SAVEPOINT sp_{}".format(depth))
+            self._transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._transaction_depth -= 1
+                self.model_cache.clear() if self.model_cache is not None else None # Instances read inside the block may be rolled back
+                self.query_cache.clear() if self.query_cache is not None else None
+                if depth == 0:
+                    self._transaction_thread = None
+                    self.execute("ROLLBACK")
+                else:
+                    self.execute("ROLLBACK TO sp_{0}".format(depth))
+                    self.execute("RELEASE sp_{0}".format(depth))
+                raise
+            else:
+                self._transaction_depth -= 1
+                if depth == 0:
+                    self._transaction_thread = None
+                    self.flush()
+                else:
+                    self.execute("RELEASE sp_{}".format(depth))
+    
+    def close(self):
+        """Commits pending writes and closes the connection."""
+        self.flush()
+        self.connection.close()
+    
     def _init(self):
         if self.__class__.REGISTER_AS_MODEL_DB:
             for table in self.__class__.TABLES:
@@ -60,12 +215,20 @@ class SQLiteDB(BaseManager):
                 self.create_table(table)
     
     def create_table(self, model: Union[ModelMeta, Model]):
-        self.cursor.execute(model.make_create_query())
-        self.commit()
+        with self._batch_lock: # Kept out of the transactions of other threads
+            self.cursor.execute(model.make_create_query())
+            for index_query in model.make_index_queries() + model.make_fulltext_queries():
+                self.cursor.execute(index_query)
+            self.commit()
+            self._tables_changed(model)
     
     def drop_table(self, model: Union[ModelMeta, Model]):
-        self.cursor.execute(model.make_drop_query())
-        self.commit()
+        with self._batch_lock:
+            self.cursor.execute(model.make_drop_query())
+            self.cursor.execute('DROP TABLE IF EXISTS "{}"'.format(model.get_fulltext_table_name())) if len(model.get_fulltext_fields()) > 0 else None
+            self.commit()
+            self.model_cache.invalidate_model(model) if self.model_cache is not None else None
+            self._tables_changed(model)
 
     def create_model(self, model):
         """Alias for craete_table"""
@@ -75,48 +238,550 @@ class SQLiteDB(BaseManager):
         """Alias for drop_table"""
         self.drop_table(model)
     
+    def _mark_saved(self, result, *objs: Model):
+        """
+        Marks objs as stored with their values as of the write, once the write succeeded: at once for sqlite3 cursors, or once 
+        the CursorTask of a proxied write is done, so a failed write leaves them to be written again by save.
+        """
+        saved = [(obj, obj.make_saved_values()) for obj in objs]
+        if isinstance(result, CursorTask):
+            result.add_done_callback(lambda task: [obj.mark_saved(values) for obj, values in saved] if not task.cancelled() and task.exception() is None else None)
+        else:
+            [obj.mark_saved(values) for obj, values in saved]
+    
     def insert(self, obj: Model, **insertKwargs):
-        self.cursor.execute(*obj.make_insert_args(**insertKwargs))
-        self.commit()
+        with self._batch_lock:
+            self._mark_saved(self.cursor.execute(*obj.make_insert_args(**insertKwargs)), obj)
+            self.commit()
+            self.model_cache.invalidate(ModelCache.make_key(obj.__class__, obj)) if self.model_cache is not None else None
+            self._tables_changed(obj.__class__)
     
-    def insert_many(self, obj_list: List[Model], **insertKwargs):
-        """Uses executemany and can insert many objects of different models."""
-        
-        model_groups = {}
-        for obj in obj_list:
-            model_groups[obj.__class__] = model_groups.get(obj.__class__, []) + [obj]
-        
-        query_groups = {table.make_insert_query(**insertKwargs) : [obj.make_insert_values() for obj in objs] for table, objs in model_groups.items()}
-
-        for query_string, execute_many_values in query_groups.items():
-            self.cursor.executemany(query_string, execute_many_values)
-            self.commit() # Commit for every model group.
+    def upsert(self, obj: Model):
+        """Inserts the object or updates its changed columns if its primary key exists."""
+        self.insert(obj, upsert=True)
+    
+    def save(self, obj: Model) -> bool:
+        """Writes only the changed fields of a stored object, or upserts it if it was never stored. Returns whether anything was written."""
+        with self._batch_lock:
+            changed_fields = obj.get_changed_fields()
+            if changed_fields is None:
+                self.upsert(obj)
+                return True
+            if len(changed_fields) == 0:
+                return False
+            result = self.cursor.execute(*obj.make_update_args(changed_fields))
+            self.commit()
+            if self.model_cache is not None:
+                self.model_cache.invalidate(ModelCache.make_key(obj.__class__, obj.get_saved_values()))
+                self.model_cache.invalidate(ModelCache.make_key(obj.__class__, obj))
+            self._tables_changed(obj.__class__)
+            self._mark_saved(result, obj)
+            return True
+    
+    def insert_many(self, objs: Iterable[Model], **insertKwargs) -> int:
+        """
+        Uses executemany and can insert many objects of different models, from any iterable including generators. 
+        Objects are grouped per model and written INSERT_MANY_CHUNK_SIZE at a time, so memory stays flat. Returns the number of objects.
+        """
+        with self._batch_lock:
+            chunks: Dict[ModelMeta, List[Model]] = {}
+            rows = 0
+            last_result = None
+            for obj in objs:
+                chunk = chunks.setdefault(obj.__class__, [])
+                chunk.append(obj)
+                self.model_cache.invalidate(ModelCache.make_key(obj.__class__, obj)) if self.model_cache is not None else None
+                if len(chunk) >= self.INSERT_MANY_CHUNK_SIZE:
+                    last_result = self._insert_chunk(obj.__class__, chunk, last_result, **insertKwargs)
+                    rows += len(chunk)
+                    chunks[obj.__class__] = []
+            
+            for model, chunk in chunks.items():
+                if len(chunk) > 0:
+                    last_result = self._insert_chunk(model, chunk, last_result, **insertKwargs)
+                    rows += len(chunk)
+            self.commit(rows=rows) # One commit for all model groups.
+            self._tables_changed(*chunks.keys())
+            return rows
+    
+    def _insert_chunk(self, model: ModelMeta, chunk: List[Model], last_result=None, **insertKwargs):
+        "Writes a chunk of insert_many. A proxied chunk is only queued once the previous one is written, so one chunk at most is in flight."
+        last_result.wait() if isinstance(last_result, CursorTask) else None
+        result = self.cursor.executemany(model.make_insert_query(**insertKwargs), [obj.make_insert_values() for obj in chunk])
+        self._mark_saved(result, *chunk)
+        return result
 
-    def _select(self, select_query) -> List[dict]:
-        self.cursor.execute(select_query)
+    def _fetchall(self, select_query: str, parameters=()) -> List[dict]:
+        self.flush_if_due()
+        self.cursor.execute(select_query, parameters)
         return self.cursor.fetchall()
     
-    def select(self, select_query) -> List[dict]:
-        return self._select(select_query)
+    def _select(self, select_query: str, parameters=()) -> List[dict]:
+        """Runs a query and fetches its rows, served by the query cache if enabled. Cached rows are shared, do not modify them."""
+        cache_key = QueryCache.make_key(select_query, parameters) if self.query_cache is not None else None
+        if cache_key is None:
+            return self._fetchall(select_query, parameters)
+        rows = self.query_cache.get(cache_key)
+        if rows is None:
+            versions = self.query_cache.get_versions(select_query) # Taken before the query, so writes made while it runs invalidate it
+            rows = self._fetchall(select_query, parameters)
+            self.query_cache.put(cache_key, versions, rows)
+        return rows
+    
+    def select(self, select_query: str, parameters=()) -> List[dict]:
+        return self._select(select_query, parameters)
+    
+    @staticmethod
+    def _iter_cursor_batches(cursor: sqlite3.Cursor, select_query: str, parameters, arraysize: int, raw: bool) -> Iterator[Tuple[Tuple[str, ...], list]]:
+        if raw:
+            cursor.row_factory = None
+        try:
+            cursor.execute(select_query, parameters)
+            columns = tuple(column[0] for column in cursor.description or ())
+            while True:
+                rows = cursor.fetchmany(arraysize)
+                if not rows:
+                    break
+                yield columns, rows
+        finally:
+            cursor.close()
+    
+    def _iter_select_batches(self, select_query: str, parameters=(), arraysize: int = None, raw: bool = False) -> Iterator[Tuple[Tuple[str, ...], list]]:
+        """Streams (columns, rows) batches of a query, rows are plain tuples if raw, else made by row_factory."""
+        self.flush_if_due()
+        # Own cursor, so other queries can run while this one is iterated
+        return self._iter_cursor_batches(self.connection.cursor(), select_query, parameters, arraysize or self.FETCH_ARRAYSIZE, raw)
+    
+    def _iter_select(self, select_query: str, parameters=(), arraysize: int = None) -> Iterator[dict]:
+        for _, rows in self._iter_select_batches(select_query, parameters, arraysize):
+            yield from rows
+    
+    def iter_select(self, select_query: str, parameters=(), arraysize: int = None) -> Iterator[dict]:
+        """Like select, but streams the rows arraysize rows at a time instead of fetching all of them at once."""
+        return self._iter_select(select_query, parameters, arraysize)
     
     def get(self, model: Model, comparators=None, **kwargs) -> Iterator[Model]:
+        """
+        Streams instances of a model, lookups by primary key are served by the model cache if enabled. A cached instance 
+        is only served while it has no unsaved changes, else the row is read again and replaces it in the cache.
+        """
         model = model.__class__ if isinstance(model, Model) else model
+        cache_key = ModelCache.make_lookup_key(model, comparators) if self.model_cache is not None and len(kwargs) == 0 else None
+        if cache_key is not None:
+            obj = self.model_cache.get(cache_key)
+            if obj is not None and obj.get_changed_fields() == []:
+                yield obj
+                return
+        
         select_query = model.make_select_query(comparators, **kwargs)
-        for entry in self._select(select_query.make_query()):
-            yield model.parse_from_db(entry)
+        for columns, rows in self._iter_select_batches(*select_query.compile(), raw=True):
+            objs = map(model.make_row_converter(columns), rows)
+            if cache_key is not None:
+                objs = [self.model_cache.put(cache_key, obj) or obj for obj in objs]
+            yield from objs
     
     def get_all(self, model: Model) -> Iterator[Model]:
         return self.get(model)
+    
+    def search(self, model: Model, query: str, limit: int = None) -> Iterator[Model]:
+        """Streams the instances whose fulltext fields match an FTS5 query, ranked by relevance."""
+        model = model.__class__ if isinstance(model, Model) else model
+        if len(model.get_fulltext_fields()) == 0:
+            raise RuntimeError("Model '{}' has no fulltext fields to search.".format(model.__name__))
+        parameters = (query, limit) if limit is not None else (query,)
+        for columns, rows in self._iter_select_batches(model.make_search_query(limit=limit is not None), parameters, raw=True):
+            yield from map(model.make_row_converter(columns), rows)
+    
+    def iter_pages(self, model: Model, comparators=None, order_by=None, page_size: int = 1000) -> Iterator[List[Model]]:
+        """Yields lists of up to page_size instances ordered by order_by, each page is sought after the last row of the previous one."""
+        model = model.__class__ if isinstance(model, Model) else model
+        orderers = model.make_page_orderers(order_by)
+        after = None
+        while True:
+            page, last_row = [], None
+            for columns, rows in self._iter_select_batches(*model.make_page_query(comparators, orderers, page_size, after).compile(), raw=True):
+                page.extend(map(model.make_row_converter(columns), rows))
+                last_row = dict(zip(columns, rows[-1]))
+            if len(page) > 0:
+                yield page
+            if len(page) < page_size:
+                return
+            after = tuple(last_row[column] for column, _ in orderers)
+    
+    def select_scalar(self, select_query: str, parameters=()):
+        """First column of the first row of a query, None if it returns no rows."""
+        batches = self._iter_select_batches(select_query, parameters, 1, raw=True)
+        try:
+            for _, rows in batches:
+                return rows[0][0]
+        finally:
+            batches.close()
+    
+    def count(self, model: Model, comparators=None) -> int:
+        model = model.__class__ if isinstance(model, Model) else model
+        return self.select_scalar(*model.make_count_query(comparators).compile())
+    
+    def exists(self, model: Model, comparators=None) -> bool:
+        model = model.__class__ if isinstance(model, Model) else model
+        return bool(self.select_scalar(*model.make_exists_query(comparators).compile()))
+    
+    def values(self, model: Model, columns: list, comparators=None, **kwargs) -> Iterator[tuple]:
+        """Streams tuples of the given columns, values of the model's fields are converted like in get."""
+        model = model.__class__ if isinstance(model, Model) else model
+        select_query = model.make_select_query(comparators, columns=columns, **kwargs)
+        for names, rows in self._iter_select_batches(*select_query.compile(), raw=True):
+            converter = model.make_values_converter(names)
+            yield from map(converter, rows) if converter is not None else rows
 
+    def fetch_columns(self, query: Union[Statement, str], parameters=(), model: Union[ModelMeta, Model] = None) -> Dict[str, Any]:
+        """
+        Runs a query and returns its result column by column, as NumPy arrays or as array.array when NumPy is not installed. 
+        Columns of the model's numeric fields get the type of their stored values, datetimes are REAL timestamps. 
+        The model defaults to the table of a statement, other columns are typed by their values and TEXT columns are lists.
+        Returns an empty dictionary if the query returns no rows.
+        """
+        if isinstance(query, Statement):
+            model = model if model is not None else next((table for table in self.__class__.TABLES if table.table_name == getattr(query, 'table_name', None)), None)
+            query, parameters = query.compile()
+        return self.make_columns(self._iter_select_batches(query, parameters, raw=True), model)
+    
+    @staticmethod
+    def make_columns(batches: Iterable[Tuple[Tuple[str, ...], list]], model: Optional[ModelMeta] = None) -> Dict[str, Any]:
+        """Packs raw (columns, rows) batches column by column, see fetch_columns."""
+        fields = {field.name: field for field in model.__FIELDS__.values()} if model is not None else {}
+        buffers: Dict[str, ColumnBuffer] = {}
+        for columns, rows in batches:
+            if len(buffers) == 0:
+                buffers = {column: ColumnBuffer(fields[column].get_array_typecode() if column in fields else None) for column in columns}
+            for buffer, values in zip(buffers.values(), zip(*rows)):
+                buffer.extend(values)
+        return {column: buffer.to_array() for column, buffer in buffers.items()}
+    
     def delete(self, model: Model, comparators=None):
-        self.cursor.execute(model.make_delete_query(comparators))
-        self.commit()
+        with self._batch_lock:
+            self.cursor.execute(*model.make_delete_args(comparators))
+            self.commit()
+            self.model_cache.invalidate_model(model.__class__ if isinstance(model, Model) else model) if self.model_cache is not None else None
+            self._tables_changed(model)
 
 
 class MultiThreadedSQLiteDB(SQLiteDB):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    """
+    Writes go through a CursorProxy, whose single daemon thread owns the writer connection. 
+    Reads are served by a ReaderPool of read-only connections, so they run in parallel across threads.
+    
+    A read waits for every write queued before it, so it sees them once they are committed. Reads are routed through 
+    the writer while batched writes are pending or their thread runs a transaction, since the pool can not see uncommitted 
+    writes. Reads of other threads never see a transaction's uncommitted writes: they stay on the pool, or without a pool 
+    wait for the transaction to end and read their rows at once.
+    """
+    PRAGMAS = 'durable' # WAL, so readers are not blocked by the writer
+    BATCH_COMMIT_TIMER = True # Commits go through the CursorProxy, so any thread may flush
+    READER_POOL_SIZE = 4
+    
+    def __init__(self, *args, initialize: bool = True, reader_pool_size: int = None, **kwargs):
+        super().__init__(*args, initialize=False, **kwargs)
         self._cursor = self.cursor
-        self.cursor: CursorProxy = CursorProxy(self.database, self._cursor)
-        self._commit = self.commit
-        self.commit = self.cursor.commit_proxy
+        self.cursor: CursorProxy = CursorProxy(self.database, self._cursor, pragmas=self.pragmas, connect_kwargs=self.get_connect_kwargs())
+        reader_pool_size = reader_pool_size if reader_pool_size is not None else self.__class__.READER_POOL_SIZE
+        self.reader_pool: Optional[ReaderPool] = ReaderPool(self.database, reader_pool_size, self.pragmas, self.row_factory, connect_kwargs=self.get_connect_kwargs()) if reader_pool_size > 0 and ReaderPool.supports(self.database) else None
+        
+        if initialize:
+            self._init()
+    
+    def commit_connection(self):
+        return self.cursor.commit_proxy()
+    
+    def in_own_transaction(self) -> bool:
+        """Whether the calling thread runs the open transaction."""
+        return self._transaction_depth > 0 and self._transaction_thread == threading.get_ident()
+    
+    def _fetchall(self, select_query: str, parameters=()) -> List[dict]:
+        if self.in_own_transaction():
+            return self.cursor.select(select_query, parameters)
+        if self.reader_pool is None or self._pending_rows > 0:
+            with self._batch_lock: # Waits for another thread's transaction, whose writes the writer connection shows uncommitted
+                return self.cursor.select(select_query, parameters)
+        self.cursor.wait_for_queued_tasks()
+        with self.reader_pool.connection() as connection:
+            return connection.execute(select_query, parameters).fetchall()
+    
+    def _iter_select_batches(self, select_query: str, parameters=(), arraysize: int = None, raw: bool = False) -> Iterator[Tuple[Tuple[str, ...], list]]:
+        arraysize = arraysize or self.FETCH_ARRAYSIZE
+        if self.in_own_transaction():
+            yield from self.cursor.iter_select_batches(select_query, parameters, arraysize, raw)
+            return
+        if self.reader_pool is None or self._pending_rows > 0:
+            # Read whole under the write lock, as a transaction opened while streaming from the writer would show its writes
+            with self._batch_lock:
+                batches = list(self.cursor.iter_select_batches(select_query, parameters, arraysize, raw))
+            yield from batches
+            return
+        self.cursor.wait_for_queued_tasks()
+        with self.reader_pool.connection() as connection: # Held until the iteration is finished or closed
+            yield from self._iter_cursor_batches(connection.cursor(), select_query, parameters, arraysize, raw)
+    
+    def close(self):
+        self.flush()
+        self.cursor.wait_for_queued_tasks()
+        self.reader_pool.close() if self.reader_pool is not None else None
+        self.connection.close()
+
+
+class SortKey:
+    """
+    Key of a row's orderer values in SQLite's order, for merging rows ordered by SQLite: NULL first, then numbers, text and 
+    blobs, each orderer ascending or descending.
+    """
+    __slots__ = ('values', 'descending')
+    TYPE_RANKS = {type(None): 0, bool: 1, int: 1, float: 1, str: 2, bytes: 3} # Other types, e.g. datetimes, compare as values
+    
+    def __init__(self, values: tuple, descending: Tuple[bool, ...]):
+        self.values = values
+        self.descending = descending
+    
+    @classmethod
+    def compare(cls, a, b) -> int:
+        rank_a, rank_b = cls.TYPE_RANKS.get(type(a), 1), cls.TYPE_RANKS.get(type(b), 1)
+        if rank_a != rank_b:
+            return -1 if rank_a < rank_b else 1
+        if a is None or a == b:
+            return 0
+        return -1 if a < b else 1
+    
+    def __lt__(self, other: 'SortKey') -> bool:
+        for a, b, descending in zip(self.values, other.values, self.descending):
+            comparison = self.compare(a, b)
+            if comparison != 0:
+                return comparison > 0 if descending else comparison < 0
+        return False
+
+
+class ShardedSQLiteDB(BaseManager):
+    """
+    Spreads the rows of every model over several database files, each a MultiThreadedSQLiteDB with a writer thread of its own, 
+    so writes to different shards run in parallel. A row's shard is a stable hash of its shard key, the model's __SHARD_KEY__ 
+    field or else its primary key.
+    
+    Queries with an equality on the shard key are sent to its shard only, others are sent to every shard and their results merged. 
+    Ordered results are merged from the shards' ordered streams, so they are never held whole. Aggregates of values and raw 
+    queries of select and fetch_columns are computed per shard, and there are no transactions across shards.
+    """
+    TABLES: List[ModelMeta] = []
+    REGISTER_AS_MODEL_DB = True
+    SHARD_COUNT = 4
+    SHARD_CLASS = MultiThreadedSQLiteDB # Shards are used from several threads at once
+    INSERT_MANY_CHUNK_SIZE = 1000 # Rows buffered per shard by insert_many before they are handed to the shard
+    
+    _repr_format = "<%(classname)s Manager with %(len(self.shards))s shards>"
+    
+    def __init__(self, database: Union[str, List[str]], *, initialize: bool = True, shard_count: int = None, **shard_kwargs):
+        """database is either a list of shard filenames, or a filename the shard number is added to, e.g. osu.db to osu.0.db."""
+        if isinstance(database, str):
+            shard_count = shard_count if shard_count is not None else self.__class__.SHARD_COUNT
+            root, ext = os.path.splitext(database)
+            database = ['{}.{}{}'.format(root, i, ext) for i in range(shard_count)]
+        self.databases = list(database)
+        shard_class = type('Shard'+self.__class__.SHARD_CLASS.__name__, (self.__class__.SHARD_CLASS,), dict(TABLES=self.__class__.TABLES, REGISTER_AS_MODEL_DB=False))
+        self.shards: List[SQLiteDB] = [shard_class(filename, initialize=False, **shard_kwargs) for filename in self.databases]
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='ShardedSQLiteDB')
+        super().__init__(self.databases[0], initialize=initialize)
+    
+    def _init(self):
+        for shard in self.shards:
+            shard._init()
+        if self.__class__.REGISTER_AS_MODEL_DB:
+            for table in self.__class__.TABLES:
+                table.register_db_manager(self)
+    
+    @staticmethod
+    def get_shard_key_field(model: ModelMeta) -> Tuple[str, Field]:
+        name = getattr(model, '__SHARD_KEY__', None)
+        if name is not None:
+            return name, model.__FIELDS__[name]
+        primary_key_fields = model.get_primary_key_fields()
+        if len(primary_key_fields) != 1:
+            raise RuntimeError("Model '{}' needs a __SHARD_KEY__ as it has no single primary key.".format(model.__name__))
+        return next(iter(primary_key_fields.items()))
+    
+    def get_shard_index(self, value) -> int:
+        """Shard of a converted shard key value, crc32 is used as hash() of strings differs between processes."""
+        return zlib.crc32(repr(value).encode()) % len(self.shards)
+    
+    def get_shard(self, obj: Model, values: dict = None) -> SQLiteDB:
+        """Shard of an instance, or of its values such as the ones last saved."""
+        name, field = self.get_shard_key_field(obj.__class__)
+        return self.shards[self.get_shard_index(field.convert_value((values if values is not None else obj)[name]))]
+    
+    def get_query_shards(self, model: ModelMeta, comparator) -> List[SQLiteDB]:
+        """Shards a query has to be sent to, one if it requires the shard key to equal a value, else all of them."""
+        _, field = self.get_shard_key_field(model)
+        statements = comparator.statements if isinstance(comparator, AND) else [comparator]
+        for statement in statements:
+            if isinstance(statement, Comparator) and statement.name == field.name and statement.op in ['==', '='] and statement.value is not None:
+                return [self.shards[self.get_shard_index(statement.value)]]
+        return self.shards
+    
+    def scatter(self, shards: List[SQLiteDB], method: Callable[[SQLiteDB], Any]) -> List[Any]:
+        """Calls method with each shard in parallel and returns their results in shard order."""
+        if len(shards) == 1:
+            return [method(shards[0])]
+        return list(self._executor.map(method, shards))
+    
+    def create_table(self, model: Union[ModelMeta, Model]):
+        self.scatter(self.shards, lambda shard: shard.create_table(model))
+    
+    def drop_table(self, model: Union[ModelMeta, Model]):
+        self.scatter(self.shards, lambda shard: shard.drop_table(model))
+    
+    def insert(self, obj: Model, **insertKwargs):
+        self.get_shard(obj).insert(obj, **insertKwargs)
+    
+    def upsert(self, obj: Model):
+        self.get_shard(obj).upsert(obj)
+    
+    def save(self, obj: Model) -> bool:
+        """Like SQLiteDB.save, a row whose shard key changed is moved to its new shard."""
+        saved_values = obj.get_saved_values()
+        shard = self.get_shard(obj)
+        previous_shard = self.get_shard(obj, saved_values) if saved_values is not None else shard
+        if previous_shard is not shard:
+            previous_shard.delete(obj.__class__, AND(*[Comparator(field.name, '==', field.convert_value(saved_values[name])) for name, field in obj.get_primary_key_fields().items()]))
+            shard.upsert(obj)
+            return True
+        return shard.save(obj)
+    
+    def insert_many(self, objs: Iterable[Model], **insertKwargs) -> int:
+        """Partitions the objects by shard, each shard writes its part on its own writer thread while the rest is partitioned."""
+        buffers: List[List[Model]] = [[] for _ in self.shards]
+        rows = 0
+        for obj in objs:
+            shard = self.get_shard(obj)
+            buffer = buffers[self.shards.index(shard)] # Few shards, cheaper than hashing the key again
+            buffer.append(obj)
+            if len(buffer) >= self.INSERT_MANY_CHUNK_SIZE:
+                rows += shard.insert_many(buffer, **insertKwargs)
+                buffer.clear()
+        for shard, buffer in zip(self.shards, buffers):
+            rows += shard.insert_many(buffer, **insertKwargs) if len(buffer) > 0 else 0
+        return rows
+    
+    def select(self, select_query: str, parameters=()) -> List[dict]:
+        """Rows of a query from every shard, concatenated in shard order."""
+        return [row for rows in self.scatter(self.shards, lambda shard: shard.select(select_query, parameters)) for row in rows]
+    
+    def _select(self, select_query: str, parameters=()) -> List[dict]:
+        return self.select(select_query, parameters)
+    
+    @staticmethod
+    def merge(streams: List[Iterator], orderers: List[Tuple[str, str]], get_value: Callable[[Any, int, str], Any]) -> Iterator:
+        """Merges streams each ordered by orderers into one, reading them lazily. get_value(item, i, column) is the item's value of the ith orderer."""
+        descending = tuple(order.upper() == 'DESC' for _, order in orderers)
+        return heapq.merge(*streams, key=lambda item: SortKey(tuple(get_value(item, i, column) for i, (column, _) in enumerate(orderers)), descending))
+    
+    @staticmethod
+    def make_value_getter(model: ModelMeta) -> Callable[[Model, int, str], Any]:
+        """get_value of merge for instances, reading a column's value through the model, as API objects keep theirs as dictionary items."""
+        names = {field.name: name for name, field in model.__FIELDS__.items()}
+        return lambda obj, i, column: obj[names.get(column, column)] if obj._has_value(names.get(column, column)) else None
+    
+    @staticmethod
+    def _iter_limited(items: Iterator, streams: List[Iterator], limit=None) -> Iterator:
+        "Yields the items within limit, then closes the shards' streams, which may hold their connections otherwise."
+        try:
+            yield from itertools.islice(items, limit.offset, limit.offset+limit.row_count) if limit is not None else items
+        finally:
+            [stream.close() for stream in streams]
+    
+    def get(self, model: Model, comparators=None, orderby=None, limit=None) -> Iterator[Model]:
+        """Streams the instances of the shards in turn, or merges their ordered streams if ordered. Stops once limit is reached."""
+        model = model.__class__ if isinstance(model, Model) else model
+        shards = self.get_query_shards(model, comparators)
+        select_query = model.make_select_query(None, orderby=orderby, limit=limit)
+        limit = select_query.limit
+        shard_limit = (limit.offset+limit.row_count, 0) if limit is not None else None # Every shard could hold all of the rows before the offset
+        streams = [shard.get(model, comparators, orderby=orderby, limit=shard_limit) for shard in shards]
+        if orderby is None or len(streams) == 1:
+            objs = itertools.chain(*streams)
+        else:
+            objs = self.merge(streams, select_query.orderby.orderers, self.make_value_getter(model))
+        return self._iter_limited(objs, streams, limit)
+    
+    def get_all(self, model: Model) -> Iterator[Model]:
+        return self.get(model)
+    
+    def count(self, model: Model, comparators=None) -> int:
+        model = model.__class__ if isinstance(model, Model) else model
+        return sum(self.scatter(self.get_query_shards(model, comparators), lambda shard: shard.count(model, comparators)))
+    
+    def exists(self, model: Model, comparators=None) -> bool:
+        model = model.__class__ if isinstance(model, Model) else model
+        return any(self.scatter(self.get_query_shards(model, comparators), lambda shard: shard.exists(model, comparators)))
+    
+    def values(self, model: Model, columns: list, comparators=None, orderby=None, limit=None, **kwargs) -> Iterator[tuple]:
+        """
+        Like SQLiteDB.values, ordered rows of the shards are merged and limit applies to all of them. 
+        Aggregates and groups are computed per shard.
+        """
+        model = model.__class__ if isinstance(model, Model) else model
+        shards = self.get_query_shards(model, comparators)
+        select_query = model.make_select_query(None, orderby=orderby, limit=limit)
+        limit = select_query.limit
+        shard_limit = (limit.offset+limit.row_count, 0) if limit is not None else None
+        if orderby is None or len(shards) == 1:
+            streams = [shard.values(model, columns, comparators, orderby=orderby, limit=shard_limit, **kwargs) for shard in shards]
+            return self._iter_limited(itertools.chain(*streams), streams, limit)
+        
+        # The orderer columns are selected too for merging, and cut off the merged rows
+        orderers, width = select_query.orderby.orderers, len(columns)
+        streams = [shard.values(model, list(columns) + [column for column, _ in orderers], comparators, orderby=orderby, limit=shard_limit, **kwargs) for shard in shards]
+        rows = self.merge(streams, orderers, lambda row, i, column: row[width+i])
+        return self._iter_limited((row[:width] for row in rows), streams, limit)
+    
+    def iter_pages(self, model: Model, comparators=None, order_by=None, page_size: int = 1000) -> Iterator[List[Model]]:
+        """Like SQLiteDB.iter_pages, every shard is paged by its own keyset and their rows merged, so a page per shard is held at most."""
+        model = model.__class__ if isinstance(model, Model) else model
+        orderers = model.make_page_orderers(order_by)
+        streams = [(obj for page in shard.iter_pages(model, comparators, order_by, page_size) for obj in page) for shard in self.get_query_shards(model, comparators)]
+        objs = self._iter_limited(self.merge(streams, orderers, self.make_value_getter(model)), streams)
+        while True:
+            page = list(itertools.islice(objs, page_size))
+            if len(page) > 0:
+                yield page
+            if len(page) < page_size:
+                return
+    
+    @staticmethod
+    def _iter_ranked(shard: SQLiteDB, model: ModelMeta, select_query: str, parameters) -> Iterator[Tuple[float, Model]]:
+        for columns, rows in shard._iter_select_batches(select_query, parameters, raw=True):
+            converter = model.make_row_converter(columns[:-1]) # The last column is the rank
+            for row in rows:
+                yield row[-1], converter(row[:-1])
+    
+    def search(self, model: Model, query: str, limit: int = None) -> Iterator[Model]:
+        """Like SQLiteDB.search, the matches of the shards are merged by rank, which every shard computes with its own statistics."""
+        model = model.__class__ if isinstance(model, Model) else model
+        if len(model.get_fulltext_fields()) == 0:
+            raise RuntimeError("Model '{}' has no fulltext fields to search.".format(model.__name__))
+        parameters = (query, limit) if limit is not None else (query,)
+        streams = [self._iter_ranked(shard, model, model.make_search_query(limit=limit is not None, rank=True), parameters) for shard in self.shards]
+        matches = self._iter_limited(heapq.merge(*streams, key=lambda match: match[0]), streams, Limit(limit) if limit is not None else None)
+        return (obj for _, obj in matches)
+    
+    def fetch_columns(self, query: Union[Statement, str], parameters=(), model: Union[ModelMeta, Model] = None) -> Dict[str, Any]:
+        """Like SQLiteDB.fetch_columns, with the rows of every shard in shard order."""
+        if isinstance(query, Statement):
+            model = model if model is not None else next((table for table in self.__class__.TABLES if table.table_name == getattr(query, 'table_name', None)), None)
+            query, parameters = query.compile()
+        return SQLiteDB.make_columns(itertools.chain.from_iterable(shard._iter_select_batches(query, parameters, raw=True) for shard in self.shards), model)
+    
+    def delete(self, model: Model, comparators=None):
+        model = model.__class__ if isinstance(model, Model) else model
+        self.scatter(self.get_query_shards(model, comparators), lambda shard: shard.delete(model, comparators))
+    
+    def flush(self):
+        self.scatter(self.shards, lambda shard: shard.flush())
+    
+    def close(self):
+        self._executor.shutdown()
+        [shard.close() for shard in self.shards] # In this thread, which owns the shards' connections
@@ -2,4 +2,4 @@
 from .base import Model, ModelMeta
 from .field import Field
 from .datatypes import *
-from .statement import NOT, OR, AND, Comparator
+from .statement import NOT, OR, AND, EXISTS, Comparator, COUNT, SUM, AVG, MIN, MAX
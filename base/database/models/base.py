@@ -1,16 +1,18 @@
 
 from types import NoneType
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from .datatypes import Index
 from .field import Field
 
 from ...helper.decorator import cached
 from ...helper.class_mixin import ReprMixin
-from .statement import AND, Comparator, Limit, OrderBy, SelectQuery
+from .statement import AND, COUNT, EXISTS, OR, BaseComparator, BaseOperator, Comparator, Limit, OrderBy, SelectQuery, Statement
 
 
 class ModelMeta(type):
     table_name: str
     __FIELDS__: Dict[str, Field]
+    __INDEXES__: List[Index]
     
     def __repr__(cls):
         return "<%s Model with %s Fields>" % (cls.__name__, len(cls.__FIELDS__))
@@ -18,19 +20,21 @@ class ModelMeta(type):
     def __new__(cls, clsname, bases, attrs, **kw):
         new_attrs = {}
         fields = {}
+        field_names = {} # Declared Field objects to their names, for resolving index columns
         
         field_class = attrs.get('__FIELD_CLASS__') if attrs.get('__FIELD_CLASS__') is not None else Field
         if not issubclass(field_class, Field):
             raise RuntimeError('__FIELD_CLASS__ must be a subclass of Field.')
         
-        if kw.get('inherit') is not None:
-            kw.pop('inherit')
+        inherit = kw.pop('inherit', None) is not None
+        if inherit:
             [fields.update(_cls.__FIELDS__) for _cls in bases if isinstance(_cls, ModelMeta)]
         
         for name, value in attrs.items():
             if not isinstance(value, Field):
                 new_attrs[name] = value
                 continue
+            field_names[id(value)] = value.name if value.name is not None else name
             fields[name] = field_class(value.type, value.name if value.name is not None else name, default=value.default, foreign_key=value.foreign_key, **value.opts)
         
         if attrs.get('__TABLE_NAME__') is not None:
@@ -45,7 +49,15 @@ class ModelMeta(type):
         
         new_attrs.update({'__FIELDS__':fields, **fields})
         
+        resolve_column = lambda column: field_names.get(id(column), column.name) if isinstance(column, Field) else column
+        indexes = [index for _cls in bases if isinstance(_cls, ModelMeta) for index in _cls.__INDEXES__] if inherit else []
+        indexes += [(index if isinstance(index, Index) else Index(*index)).resolve(resolve_column) for index in attrs.get('__INDEXES__', [])]
+        indexes += [Index(field.name) for field in fields.values() if field.opts.get('INDEX', False)]
+        new_attrs['__INDEXES__'] = indexes
+        
         new_attrs['DB_MANAGER'] = attrs.get('DB_MANAGER')
+        new_attrs['_ROW_CONVERTERS'] = {} # Compiled by make_row_converter, per model and columns
+        new_attrs['_VALUES_CONVERTERS'] = {} # Compiled by make_values_converter, per model and columns
         
         return super().__new__(cls, clsname, bases, new_attrs, **kw)
     
@@ -93,12 +105,119 @@ class Model(ReprMixin, metaclass=ModelMeta):
     
     @classmethod
     @cached()
-    def make_insert_query(cls, replace=False, ignore=False) -> str:
-        command = "INSERT " +("INTO OR IGNORE" if ignore else "OR REPLACE INTO" if replace else "INTO")
+    def make_index_queries(cls) -> List[str]:
+        return [index.make_create_query(cls) for index in cls.__INDEXES__]
+    
+    @classmethod
+    def get_fulltext_fields(cls) -> Dict[str, Field]:
+        return {name: field for name, field in cls.__FIELDS__.items() if field.opts.get('FULLTEXT', False)}
+    
+    @classmethod
+    def get_fulltext_table_name(cls) -> str:
+        return '{}_fts'.format(cls.table_name)
+    
+    @classmethod
+    @cached()
+    def make_fulltext_queries(cls) -> List[str]:
+        """
+        Creates the FTS5 table indexing the fulltext fields, kept in sync by triggers and filled from existing rows when empty. 
+        Index entries are removed by rowid, so rows replaced by INSERT OR REPLACE, which fires no delete trigger, are not indexed twice.
+        Updates only reindex a row if they change its fulltext fields or its primary key, which may be its rowid. The update 
+        trigger is recreated, so tables created with the former trigger firing on every update get this one.
+        """
+        columns = [field.name for field in cls.get_fulltext_fields().values()]
+        if len(columns) == 0:
+            return []
+        table, fts_table = cls.table_name, cls.get_fulltext_table_name()
+        columns_str = ", ".join(columns)
+        update_columns = list(dict.fromkeys(columns + [field.name for field in cls.get_primary_key_fields().values()]))
+        insert_str = 'INSERT INTO "{}"(rowid, {}) VALUES (new.rowid, {});'.format(fts_table, columns_str, ", ".join('new.'+column for column in columns))
+        delete_str = 'DELETE FROM "{}" WHERE rowid = {{}}.rowid;'.format(fts_table)
+        return ['CREATE VIRTUAL TABLE IF NOT EXISTS "{}" USING fts5({})'.format(fts_table, columns_str), 
+                'CREATE TRIGGER IF NOT EXISTS "{0}_ai" AFTER INSERT ON "{1}" BEGIN {2} {3} END'.format(fts_table, table, delete_str.format('new'), insert_str), 
+                'CREATE TRIGGER IF NOT EXISTS "{0}_ad" AFTER DELETE ON "{1}" BEGIN {2} END'.format(fts_table, table, delete_str.format('old')), 
+                'DROP TRIGGER IF EXISTS "{}_au"'.format(fts_table), 
+                'CREATE TRIGGER "{0}_au" AFTER UPDATE OF {1} ON "{2}" BEGIN {3} {4} END'.format(fts_table, ", ".join(update_columns), table, delete_str.format('old'), insert_str), 
+                'INSERT INTO "{0}"(rowid, {1}) SELECT rowid, {1} FROM "{2}" WHERE NOT EXISTS (SELECT 1 FROM "{0}")'.format(fts_table, columns_str, table)]
+    
+    @classmethod
+    @cached()
+    def make_search_query(cls, limit=False, rank=False) -> str:
+        """
+        Rows matching an FTS5 query, best ranked first. Parameters are the query, plus the row count if limit.
+        The limit applies after joining the table, so index entries left by rows replaced without a delete trigger are not counted.
+        If rank, the rank of a row is selected as its last column.
+        """
+        return ('SELECT "{0}".*{3} FROM "{1}" JOIN "{0}" ON "{0}".rowid = "{1}".rowid WHERE "{1}" MATCH ? ORDER BY "{1}".rank{2}'
+                ).format(cls.table_name, cls.get_fulltext_table_name(), ' LIMIT ?' if limit else '', ', "{}".rank'.format(cls.get_fulltext_table_name()) if rank else '')
+    
+    @classmethod
+    def get_primary_key_fields(cls) -> Dict[str, Field]:
+        return {name: field for name, field in cls.__FIELDS__.items() if field.opts.get('PRIMARY KEY', False)}
+    
+    @classmethod
+    @cached()
+    def make_insert_query(cls, replace=False, ignore=False, upsert=False) -> str:
+        """
+        upsert updates the existing row on a primary key conflict instead of deleting and reinserting it like replace, 
+        and leaves it untouched if none of its values changed.
+        """
+        command = "INSERT " +("OR IGNORE INTO" if ignore else "OR REPLACE INTO" if replace else "INTO")
         _s = "{command} {table_name} VALUES ({values_placeholder})".format(command=command, table_name=cls.table_name, 
                                                                             values_placeholder=','.join([':{}'.format(field.name) for field in cls.__FIELDS__.values()]))
+        if upsert:
+            primary_keys = [field.name for field in cls.get_primary_key_fields().values()]
+            if len(primary_keys) == 0:
+                raise RuntimeError("Model '{}' has no primary key to upsert on.".format(cls.__name__))
+            columns = [field.name for field in cls.__FIELDS__.values() if field.name not in primary_keys]
+            _s += " ON CONFLICT({}) ".format(", ".join(primary_keys))
+            _s += "DO UPDATE SET {} WHERE {}".format(", ".join("{0} = excluded.{0}".format(column) for column in columns), 
+                                                     " OR ".join("{0}.{1} IS NOT excluded.{1}".format(cls.table_name, column) for column in columns)) if columns else "DO NOTHING"
         return _s
     
+    @classmethod
+    @cached()
+    def make_update_query(cls, columns: Tuple[str, ...] = ()) -> str:
+        """UPDATE of the given columns of the row with the primary key, call with columns as keyword for caching."""
+        primary_keys = [field.name for field in cls.get_primary_key_fields().values()]
+        if len(primary_keys) == 0:
+            raise RuntimeError("Model '{}' has no primary key to update by.".format(cls.__name__))
+        return "UPDATE {} SET {} WHERE {}".format(cls.table_name, ", ".join("{} = ?".format(column) for column in columns), " AND ".join("{} = ?".format(column) for column in primary_keys))
+    
+    def get_saved_values(self) -> Optional[dict]:
+        """Values of the fields as of the last load from or write to the database, None if the instance was never stored."""
+        return self.__dict__.get('_saved_values')
+    
+    def make_saved_values(self) -> dict:
+        """The current values of the fields, as recorded by mark_saved."""
+        return {name: self[name] for name in self.__FIELDS__ if self._has_value(name)}
+    
+    def mark_saved(self, values: dict = None):
+        """Records the current values as stored in the database, so later changes are detected by get_changed_fields."""
+        object.__setattr__(self, '_saved_values', values if values is not None else self.make_saved_values())
+    
+    def _has_value(self, name) -> bool:
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+    
+    def get_changed_fields(self) -> Optional[List[str]]:
+        """Names of the fields changed since the instance was last stored, None if it was never stored."""
+        saved_values = self.get_saved_values()
+        if saved_values is None:
+            return None
+        return [name for name in self.__FIELDS__ if self._has_value(name) and (name not in saved_values or saved_values[name] != self[name])]
+    
+    def make_update_args(self, names: List[str]) -> Tuple[str, list]:
+        """UPDATE of the given fields, the row is found by the primary key as it was last stored, so changing the key is supported."""
+        values = self.make_insert_values()
+        saved_values = self.get_saved_values() or {}
+        query = self.__class__.make_update_query(columns=tuple(self.__FIELDS__[name].name for name in names))
+        keys = [field.convert_value(saved_values[name]) if name in saved_values else values[field.name] for name, field in self.get_primary_key_fields().items()]
+        return (query, [values[self.__FIELDS__[name].name] for name in names] + keys)
+    
     def make_insert_values(self) -> str:
         entry_data = {}
         for name_in_obj, field in self.__FIELDS__.items():
@@ -113,13 +232,14 @@ class Model(ReprMixin, metaclass=ModelMeta):
                 entry_data[field.name] = field.get_default_value()
         return entry_data
         
-    def make_insert_args(self, replace=False, ignore=False) -> Tuple[str, Any]:
-        query = self.__class__.make_insert_query(replace=replace, ignore=ignore)
+    def make_insert_args(self, replace=False, ignore=False, upsert=False) -> Tuple[str, Any]:
+        query = self.__class__.make_insert_query(replace=replace, ignore=ignore, upsert=upsert)
         values = self.make_insert_values()
         return (query, values)
     
     @classmethod
-    def make_select_query(cls, comparator: Union[Comparator, NoneType] = None, orderby: Union[OrderBy, Iterable[Tuple], Tuple]= None, limit: Union[Limit, int, Tuple] = None) -> SelectQuery:
+    def make_select_query(cls, comparator: Union[Comparator, NoneType] = None, orderby: Union[OrderBy, Iterable[Tuple], Tuple]= None, limit: Union[Limit, int, Tuple] = None, 
+                          columns: Optional[List[Any]] = None, groupby: Optional[List[Any]] = None, having: Optional[Statement] = None) -> SelectQuery:
         if not isinstance(orderby, (OrderBy, NoneType)):
             if isinstance(orderby, tuple):
                 orderby = [orderby]
@@ -128,7 +248,58 @@ class Model(ReprMixin, metaclass=ModelMeta):
             if isinstance(limit, int):
                 limit = [limit]
             limit = Limit(*limit)
-        return SelectQuery(table_name=cls.table_name, comparator=comparator, orderby=orderby, limit=limit)
+        return SelectQuery(table_name=cls.table_name, comparator=comparator, orderby=orderby, limit=limit, columns=columns, groupby=groupby, having=having)
+    
+    @classmethod
+    def make_page_orderers(cls, order_by: Union[Tuple[str, str], Field, NoneType] = None) -> List[Tuple[str, str]]:
+        """
+        Orderers of keyset pagination, order_by such as Beatmap.approved.DESC defaults to the primary key ascending. 
+        The primary key is appended as a tie breaker, so the order is unique and pages never skip or repeat rows.
+        """
+        primary_keys = [field.name for field in cls.get_primary_key_fields().values()]
+        if order_by is None:
+            if len(primary_keys) == 0:
+                raise RuntimeError("Model '{}' has no primary key to paginate by, order_by is required.".format(cls.__name__))
+            order_by = (primary_keys[0], 'ASC')
+        order_by = order_by.ASC if isinstance(order_by, Field) else (order_by, 'ASC') if isinstance(order_by, str) else tuple(order_by)
+        return [order_by] + [(primary_key, order_by[1]) for primary_key in primary_keys if primary_key != order_by[0]]
+    
+    @classmethod
+    def make_page_query(cls, comparator: Union[Comparator, NoneType], orderers: List[Tuple[str, str]], page_size: int, after: Optional[tuple] = None) -> SelectQuery:
+        """
+        Query of the page following the row whose orderer columns have the values after, the first page if None. 
+        It seeks with WHERE key > last key instead of skipping rows with an offset, so every page costs the same however deep it is.
+        """
+        if after is not None:
+            # (a, b) > (x, y) expanded to a > x OR (a = x AND b > y), as row values can not mix ASC and DESC
+            seekers = []
+            for i, (column, order) in enumerate(orderers):
+                follower = cls.make_page_follower(column, order, after[i])
+                if follower is None:
+                    continue
+                equals = [Comparator(previous_column, '==', value) for (previous_column, _), value in zip(orderers[:i], after)] # == None compiles to IS NULL
+                seekers.append(AND(*equals, follower))
+            seeker = OR(*seekers) if len(seekers) > 1 else seekers[0] if len(seekers) > 0 else Comparator('0', '==', 1) # Nothing follows
+            comparator = AND(comparator, seeker) if comparator is not None else seeker
+        return cls.make_select_query(comparator, orderby=OrderBy(orderers), limit=Limit(page_size))
+    
+    @staticmethod
+    def make_page_follower(column: str, order: str, value: Any) -> Optional[Statement]:
+        """
+        Comparator of the values of column ordered after value. SQLite orders NULL before any value, so after NULL come 
+        the values which are not NULL in ascending order and nothing in descending order, where NULL comes after every value.
+        """
+        if order.upper() == 'DESC':
+            return OR(Comparator(column, '<', value), Comparator(column, '==', None)) if value is not None else None
+        return Comparator(column, '>', value) if value is not None else Comparator(column, '!=', None)
+    
+    @classmethod
+    def make_count_query(cls, comparator: Union[Comparator, NoneType] = None) -> SelectQuery:
+        return cls.make_select_query(comparator, columns=[COUNT()])
+    
+    @classmethod
+    def make_exists_query(cls, comparator: Union[Comparator, NoneType] = None) -> SelectQuery:
+        return SelectQuery(None, columns=[EXISTS(cls.make_select_query(comparator, columns=['1']))])
     
     @classmethod
     def make_delete_query(cls, comparator=None, delete_all=False) -> str:
@@ -137,6 +308,14 @@ class Model(ReprMixin, metaclass=ModelMeta):
                 return "DELETE FROM %s" % (cls.table_name)
             raise RuntimeError("make_delete_query is called with no comparator!") # protective measures
         return "DELETE FROM %s WHERE %s" % (cls.table_name, comparator.make_query())
+    
+    @classmethod
+    def make_delete_args(cls, comparator=None, delete_all=False) -> Tuple[str, list]:
+        """Like make_delete_query, but with the comparator's values as bound parameters."""
+        if comparator is None:
+            return (cls.make_delete_query(comparator, delete_all=delete_all), [])
+        sql, params = comparator.compile()
+        return ("DELETE FROM %s WHERE %s" % (cls.table_name, sql), params)
 
     @classmethod
     def db_manager_registered(cls, raise_err=True) -> Optional[bool]:
@@ -153,7 +332,48 @@ class Model(ReprMixin, metaclass=ModelMeta):
 
     @classmethod
     def parse_from_db(cls, db_entry_data: dict) -> 'Model':
-        return cls({k: cls.__FIELDS__[k].invert_value_conversion(v) for k, v in db_entry_data.items()})
+        return cls.make_row_converter(tuple(db_entry_data.keys()))(tuple(db_entry_data.values()))
+    
+    @classmethod
+    def from_db_values(cls, data: dict) -> 'Model':
+        """Makes an instance from already converted database values, without validating them again."""
+        obj = cls.__new__(cls)
+        obj.__dict__.update(data)
+        obj.mark_saved(data)
+        return obj
+    
+    @classmethod
+    def make_row_converter(cls, columns: Tuple[str, ...]) -> Callable[[tuple], 'Model']:
+        """Compiles a function turning raw database rows with the given columns into instances, cached per columns."""
+        converter = cls._ROW_CONVERTERS.get(columns)
+        if converter is not None:
+            return converter
+        
+        fields = {field.name: (name, field) for name, field in cls.__FIELDS__.items()}
+        names = tuple(fields[column][0] if column in fields else column for column in columns)
+        inverters = tuple(fields[column][1].get_value_inverter() if column in fields else None for column in columns)
+        from_db_values = cls.from_db_values
+        if all(inverter is None for inverter in inverters):
+            converter = lambda row: from_db_values(dict(zip(names, row)))
+        else:
+            converted = [(name, inverter) for name, inverter in zip(names, inverters)]
+            converter = lambda row: from_db_values({name: value if inverter is None or value is None else inverter(value) for (name, inverter), value in zip(converted, row)})
+        cls._ROW_CONVERTERS[columns] = converter
+        return converter
+
+    @classmethod
+    def make_values_converter(cls, columns: Tuple[str, ...]) -> Optional[Callable[[tuple], tuple]]:
+        """Like make_row_converter, but converts raw rows to tuples of values. None if the rows need no conversion."""
+        if columns in cls._VALUES_CONVERTERS:
+            return cls._VALUES_CONVERTERS[columns]
+        
+        fields = {field.name: field for field in cls.__FIELDS__.values()}
+        inverters = tuple(fields[column].get_value_inverter() if column in fields else None for column in columns)
+        converter = None
+        if any(inverter is not None for inverter in inverters):
+            converter = lambda row: tuple(value if inverter is None or value is None else inverter(value) for inverter, value in zip(inverters, row))
+        cls._VALUES_CONVERTERS[columns] = converter
+        return converter
 
     @classmethod
     def get(cls, *comparators, **kwargs) -> List['Model']:
@@ -166,10 +386,61 @@ class Model(ReprMixin, metaclass=ModelMeta):
         if cls.db_manager_registered():
             return cls.DB_MANAGER.get_all(cls)
 
+    @classmethod
+    def count(cls, *comparators) -> int:
+        if cls.db_manager_registered():
+            return cls.DB_MANAGER.count(cls, AND(*comparators) if len(comparators) > 0 else None)
+    
+    @classmethod
+    def exists(cls, *comparators) -> bool:
+        if cls.db_manager_registered():
+            return cls.DB_MANAGER.exists(cls, AND(*comparators) if len(comparators) > 0 else None)
+    
+    @classmethod
+    def select_values(cls, *columns_and_comparators, **kwargs) -> Iterator[Any]:
+        """
+        Streams the given columns without making instances, e.g. Beatmap.select_values('beatmap_id', Beatmap.approved > 0). 
+        Not named values, which API objects inherit from dict. 
+        Columns are names, Fields or aggregates, the other arguments are filters. Yields scalars for one column, else tuples.
+        kwargs are passed to make_select_query, e.g. groupby or orderby.
+        """
+        if cls.db_manager_registered():
+            comparators = [arg for arg in columns_and_comparators if isinstance(arg, (BaseComparator, BaseOperator))]
+            columns = [arg for arg in columns_and_comparators if not isinstance(arg, (BaseComparator, BaseOperator))]
+            rows = cls.DB_MANAGER.values(cls, columns, AND(*comparators) if len(comparators) > 0 else None, **kwargs)
+            if len(columns) != 1:
+                return rows
+            return (row[0] async for row in rows) if hasattr(rows, '__aiter__') else (row[0] for row in rows)
+
+    @classmethod
+    def fetch_columns(cls, *columns_and_comparators, **kwargs) -> Dict[str, Any]:
+        """Like select_values, but returns each column as a NumPy array, or as array.array without NumPy. See SQLiteDB.fetch_columns."""
+        if cls.db_manager_registered():
+            comparators = [arg for arg in columns_and_comparators if isinstance(arg, (BaseComparator, BaseOperator))]
+            columns = [arg for arg in columns_and_comparators if not isinstance(arg, (BaseComparator, BaseOperator))]
+            return cls.DB_MANAGER.fetch_columns(cls.make_select_query(AND(*comparators) if len(comparators) > 0 else None, columns=columns or None, **kwargs), model=cls)
+    
+    @classmethod
+    def search(cls, query: str, limit: int = None) -> Iterator['Model']:
+        """Full-text search over the fulltext fields with FTS5 query syntax, e.g. Beatmap.search('title:freedom'), best matches first."""
+        if cls.db_manager_registered():
+            return cls.DB_MANAGER.search(cls, query, limit=limit)
+    
+    @classmethod
+    def iter_pages(cls, *comparators, order_by: Union[Tuple[str, str], Field, NoneType] = None, page_size: int = 1000) -> Iterator[List['Model']]:
+        """Yields lists of up to page_size instances with keyset pagination, e.g. Beatmap.iter_pages(order_by=Beatmap.beatmap_id.ASC, page_size=500)."""
+        if cls.db_manager_registered():
+            return cls.DB_MANAGER.iter_pages(cls, AND(*comparators) if len(comparators) > 0 else None, order_by=order_by, page_size=page_size)
+
     @classmethod
     def delete(cls, *comparators):
         if cls.db_manager_registered():
             return cls.DB_MANAGER.delete(cls, AND(*comparators))
+    
+    def save(self) -> bool:
+        """Writes the changed fields, or upserts the instance if it was never stored. Returns whether anything was written."""
+        if self.db_manager_registered():
+            return self.DB_MANAGER.save(self)
 
     def to_dict(self) -> dict:
-        return self.__dict__
+        return {name: value for name, value in self.__dict__.items() if name != '_saved_values'}
@@ -1,9 +1,48 @@
 
+import zlib
 from collections import namedtuple
 from datetime import datetime
+from typing import Any, Optional, Tuple
 
 
 ForeignKey = namedtuple('ForeignKey', ('key', 'referenced_table', 'referenced_key'))
+
+
+class Index:
+    """
+    A secondary index over one or more columns, declared in a model's __INDEXES__.
+    
+    Columns are column names, Fields or (column, 'ASC'/'DESC') pairs. where makes a partial index, it is either SQL, 
+    a statement or a callable taking the model and returning one, e.g. lambda model: model.approved > 0 inside the class body. 
+    Its values are inlined, since index definitions can not have parameters.
+    """
+    def __init__(self, *columns: Any, name: Optional[str] = None, unique: bool = False, where: Any = None):
+        self.columns = columns
+        self.name = name
+        self.unique = unique
+        self.where = where
+    
+    def __repr__(self):
+        return "<{} name={} columns={}>".format(self.__class__.__name__, self.name, self.columns)
+    
+    def resolve(self, resolve_column) -> 'Index':
+        "Returns a copy with columns resolved to (name, order) pairs by resolve_column, which turns Fields into column names."
+        columns = tuple((resolve_column(column[0]), column[1]) if isinstance(column, tuple) else (resolve_column(column), None) for column in self.columns)
+        return self.__class__(*columns, name=self.name, unique=self.unique, where=self.where)
+    
+    def make_create_query(self, model) -> str:
+        table_name = model.table_name
+        where = self.where(model) if callable(self.where) else self.where
+        columns: Tuple[Tuple[str, Optional[str]], ...] = tuple(column if isinstance(column, tuple) else (column, None) for column in self.columns)
+        where_sql = (where if isinstance(where, str) else where.make_query()) if where is not None else None
+        # Partial indexes are named by a hash of their predicate too, so ones on the same columns do not share a name
+        name = self.name if self.name is not None else 'idx_{}_{}{}'.format(table_name, '_'.join(column for column, _ in columns), 
+                                                                            '_partial_{:08x}'.format(zlib.crc32(where_sql.encode())) if where_sql is not None else '')
+        columns_str = ", ".join('"{}"{}'.format(column, ' '+order if order else '') for column, order in columns)
+        where_str = ' WHERE {}'.format(where_sql) if where_sql is not None else ''
+        return 'CREATE {}INDEX IF NOT EXISTS "{}" ON "{}"({}){}'.format('UNIQUE ' if self.unique else '', name, table_name, columns_str, where_str)
+
+
 BLOB = blob = type('BLOB', (), {})
 INT = Int = int
 STR = Str = str
@@ -11,7 +50,7 @@ FLOAT = Float = float
 DATETIME = DateTime = datetime
 BOOLEAN = Boolean = bool
 
-__all__ = ['ForeignKey', 
+__all__ = ['ForeignKey', 'Index', 
            'BLOB', 'blob', 
            'INT', 'Int', 
            'STR', 'Str', 
@@ -1,7 +1,7 @@
 
 from types import NoneType
 from datetime import datetime, timezone
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Optional
 
 from ...helper.decorator import cached
 from ...helper.class_mixin import ReprMixin
@@ -10,8 +10,10 @@ from .statement import Comparator
 
 
 class BaseConverter:
-    OPTS: Dict[str, str] = {'not_null': 'NOT NULL', 'primary_key':'PRIMARY KEY', 'auto_increment':'AUTO INCREMENT', 'unique':'UNIQUE'}
+    NATIVE_TYPES: set = set() # Types the database already returns as the right Python type, their reverse conversion is skipped
+    OPTS: Dict[str, str] = {'not_null': 'NOT NULL', 'primary_key':'PRIMARY KEY', 'auto_increment':'AUTO INCREMENT', 'unique':'UNIQUE', 'index':'INDEX', 'fulltext':'FULLTEXT'}
     TYPE: Dict[type, str] = {int:'INTEGER', str:'TEXT', blob:'BLOB', float:'REAL', datetime:'REAL', bool:'INTEGER', NoneType:'NULL'}
+    ARRAY_TYPECODE: Dict[type, str] = {int:'q', float:'d', datetime:'d', bool:'b'} # array.array typecodes of stored values for columnar fetches, datetimes are REAL timestamps
     VALUE: Dict[type, Callable] = {
         int: int, str: str, float:float, 
         blob: str, 
@@ -24,8 +26,10 @@ class BaseConverter:
 
 
 class SQLiteConverter(BaseConverter):
-    OPTS: Dict[str, str] = {'not_null': 'NOT NULL', 'primary_key':'PRIMARY KEY', 'auto_increment':'AUTO INCREMENT', 'unique':'UNIQUE'}
+    NATIVE_TYPES: set = {int, str, float}
+    OPTS: Dict[str, str] = {'not_null': 'NOT NULL', 'primary_key':'PRIMARY KEY', 'auto_increment':'AUTO INCREMENT', 'unique':'UNIQUE', 'index':'INDEX', 'fulltext':'FULLTEXT'}
     TYPE: Dict[type, str] = {int:'INTEGER', str:'TEXT', blob:'BLOB', float:'REAL', datetime:'REAL', bool:'INTEGER', NoneType:'NULL'}
+    ARRAY_TYPECODE: Dict[type, str] = {int:'q', float:'d', datetime:'d', bool:'b'} # array.array typecodes of stored values for columnar fetches, datetimes are REAL timestamps
     VALUE: Dict[type, Callable] = {
         int: int, str: lambda s:str(s) if s is not None else None, float:float, 
         blob: lambda s:str(s) if s is not None else None,
@@ -52,9 +56,7 @@ class _Field(ReprMixin):
     
     def make_comparator(self, op, other) -> 'Comparator':
         if self.is_valid(other):
-            if self.get_type_str() in ['TEXT', 'BLOB']:
-                return Comparator(self.name, op, '"{}"'.format(self.convert_value(other)))
-            return Comparator(self.name, op, self.convert_value(other))
+            return Comparator(self.name, op, self.convert_value(other) if other is not None else None) # Values are bound as parameters, see Statement.compile
     
     def __eq__(self, other) -> 'Comparator':
         return self.make_comparator('==', other)
@@ -88,6 +90,16 @@ class _Field(ReprMixin):
     def invert_value_conversion(self, value):
         return self.CONVERTER.REVERSE_VALUE.get(self.type, self.CONVERTER.REVERSE_VALUE[-1])(value)
     
+    def get_value_inverter(self) -> Optional[Callable]:
+        """The reverse conversion applied to non-NULL database values, None if the database value is used as is."""
+        if self.type in self.CONVERTER.NATIVE_TYPES:
+            return None
+        return self.CONVERTER.REVERSE_VALUE.get(self.type, self.CONVERTER.REVERSE_VALUE[-1])
+    
+    def get_array_typecode(self) -> Optional[str]:
+        """array.array typecode of the stored values, None for columns not stored as numbers such as TEXT."""
+        return self.CONVERTER.ARRAY_TYPECODE.get(self.type)
+    
     def get_type_str(self) -> str:
         return self.CONVERTER.TYPE.get(self.type)
     
@@ -107,7 +119,7 @@ class _Field(ReprMixin):
     @cached()
     def generate_field_query(self) -> str:
         type_str = self.get_type_str()
-        opts_str = " ".join([opt for opt, enabled in self.opts.items() if enabled and opt not in ['PRIMARY KEY', 'AUTO INCREMENT']]).strip()
+        opts_str = " ".join([opt for opt, enabled in self.opts.items() if enabled and opt not in ['PRIMARY KEY', 'AUTO INCREMENT', 'INDEX', 'FULLTEXT']]).strip()
         default_str = "DEFAULT {}".format(repr(self.get_default_value())) if self.default is not None else ''
         
         primary_key_str = (""",\nPRIMARY KEY({})""".format('"{}" {}'.format(self.name, "AUTOINCREMENT" if self.opts.get('AUTO INCREMENT', False) else "").strip())) if self.opts.get('PRIMARY KEY', False) else ""
@@ -121,5 +133,5 @@ class _Field(ReprMixin):
 
 
 class Field(_Field):
-    def __init__(self, _type: type, name: str = None, *_, default: Any = None, foreign_key: ForeignKey = None, primary_key: bool = False, not_null: bool = False, auto_increment: bool = False, unique: bool = False, **kwargs):
-        super().__init__(_type, name, *_, default=default, foreign_key=foreign_key, primary_key=primary_key, not_null=not_null, auto_increment=auto_increment, unique=unique, **kwargs)
+    def __init__(self, _type: type, name: str = None, *_, default: Any = None, foreign_key: ForeignKey = None, primary_key: bool = False, not_null: bool = False, auto_increment: bool = False, unique: bool = False, index: bool = False, fulltext: bool = False, **kwargs):
+        super().__init__(_type, name, *_, default=default, foreign_key=foreign_key, primary_key=primary_key, not_null=not_null, auto_increment=auto_increment, unique=unique, index=index, fulltext=fulltext, **kwargs)
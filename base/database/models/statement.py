@@ -1,14 +1,57 @@
 import abc
 from types import NoneType
-from typing import List, Tuple, Literal, Union
+from typing import Any, Dict, Hashable, List, Tuple, Literal, Union
+
+
+COMPILED_SQL_CACHE_SIZE = 1024
+_COMPILED_SQL: Dict[Hashable, str] = {} # SQL of compiled statements, keyed by their shape
+
+
+def sql_literal(value: Any) -> str:
+    """Renders a value as an SQLite literal."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, bytes):
+        return "X'{}'".format(value.hex())
+    return "'{}'".format(str(value).replace("'", "''"))
 
 
 # Base Classes
 
 class Statement(abc.ABC):
+    """
+    A node of a statement tree. Statements compile to SQL with ? placeholders plus a list of bound parameters. 
+    The SQL only depends on the statement's shape, the tree without its values, so it is cached per shape and 
+    repeated queries of one shape reuse a single prepared statement in sqlite3's statement cache.
+    """
+    @abc.abstractmethod
+    def compile_shape(self, params: list) -> Hashable:
+        """Appends the statement's parameters to params, in the order of their placeholders, and returns its shape."""
+    
     @abc.abstractmethod
-    def make_query(self):
-        pass
+    def make_sql(self) -> str:
+        """SQL of the statement with ? placeholders."""
+    
+    def compile(self) -> Tuple[str, list]:
+        params = []
+        shape = self.compile_shape(params)
+        sql = _COMPILED_SQL.get(shape)
+        if sql is None:
+            sql = self.make_sql()
+            if len(_COMPILED_SQL) >= COMPILED_SQL_CACHE_SIZE:
+                _COMPILED_SQL.clear()
+            _COMPILED_SQL[shape] = sql
+        return sql, params
+    
+    def make_query(self) -> str:
+        """SQL of the statement with its parameters inlined as literals, prefer compile for execution."""
+        sql, params = self.compile()
+        parts = sql.split('?')
+        return parts[0] + ''.join(sql_literal(param)+part for param, part in zip(params, parts[1:]))
     
     def __repr__(self) -> str:
         return "<Statement>"
@@ -35,8 +78,11 @@ class UnaryOperator(BaseOperator):
     def __init__(self, statement: Statement):
         self.statement = statement
     
-    def make_query(self) -> str:
-        return '{} {}'.format(self.__class__.OPERATOR, self.statement)
+    def compile_shape(self, params: list) -> Hashable:
+        return (self.__class__.OPERATOR, self.statement.compile_shape(params))
+    
+    def make_sql(self) -> str:
+        return '{} ({})'.format(self.__class__.OPERATOR, self.statement.make_sql())
 
 
 class BinaryOperator(BaseOperator):
@@ -45,8 +91,11 @@ class BinaryOperator(BaseOperator):
         self.left = left
         self.right = right
     
-    def make_query(self) -> str:
-        return '{} {} {}'.format(self.left.make_query(), self.__class__.OPERATOR, self.right.make_query())
+    def compile_shape(self, params: list) -> Hashable:
+        return (self.__class__.OPERATOR, self.left.compile_shape(params), self.right.compile_shape(params))
+    
+    def make_sql(self) -> str:
+        return '({}) {} ({})'.format(self.left.make_sql(), self.__class__.OPERATOR, self.right.make_sql())
 
 
 class JoinOperator(BinaryOperator):
@@ -55,8 +104,12 @@ class JoinOperator(BinaryOperator):
     def __init__(self, *statements: Statement):
         self.statements = statements
     
-    def make_query(self) -> str:
-        return ' {} '.format(self.__class__.OPERATOR).join([statement.make_query() for statement in self.statements])
+    def compile_shape(self, params: list) -> Hashable:
+        return (self.__class__.OPERATOR,) + tuple(statement.compile_shape(params) for statement in self.statements)
+    
+    def make_sql(self) -> str:
+        # Nested operators are parenthesized, AND(OR(a, b), c) would otherwise compile to a OR b AND c.
+        return ' {} '.format(self.__class__.OPERATOR).join([('({})' if isinstance(statement, BaseOperator) else '{}').format(statement.make_sql()) for statement in self.statements])
 
 
 # Operators
@@ -70,6 +123,65 @@ class OR(JoinOperator):
 class AND(JoinOperator):
     OPERATOR = 'AND'
 
+class EXISTS(UnaryOperator):
+    "Whether a SelectQuery returns any rows"
+    OPERATOR = 'EXISTS'
+
+
+# Aggregates
+
+class Aggregate(Statement):
+    """An aggregate function over a column, used as a SelectQuery column or compared in HAVING, e.g. COUNT() > 1."""
+    FUNCTION = ''
+    def __init__(self, column: Any = '*', distinct: bool = False, alias: str = None):
+        self.column = getattr(column, 'name', column) # Column name or Field
+        self.distinct = distinct
+        self.alias = alias
+    
+    __hash__ = Statement.__hash__
+    
+    def compile_shape(self, params: list) -> Hashable:
+        return (self.__class__.FUNCTION, self.column, self.distinct)
+    
+    def make_sql(self) -> str:
+        return '{}({}{})'.format(self.__class__.FUNCTION, 'DISTINCT ' if self.distinct else '', self.column)
+    
+    def make_comparator(self, op, other) -> 'Comparator':
+        return Comparator(self.make_sql(), op, other)
+    
+    def __eq__(self, other) -> 'Comparator':
+        return self.make_comparator('==', other)
+    
+    def __ne__(self, other) -> 'Comparator':
+        return self.make_comparator('!=', other)
+    
+    def __lt__(self, other) -> 'Comparator':
+        return self.make_comparator('<', other)
+    
+    def __le__(self, other) -> 'Comparator':
+        return self.make_comparator('<=', other)
+    
+    def __gt__(self, other) -> 'Comparator':
+        return self.make_comparator('>', other)
+    
+    def __ge__(self, other) -> 'Comparator':
+        return self.make_comparator('>=', other)
+
+class COUNT(Aggregate):
+    FUNCTION = 'COUNT'
+
+class SUM(Aggregate):
+    FUNCTION = 'SUM'
+
+class AVG(Aggregate):
+    FUNCTION = 'AVG'
+
+class MIN(Aggregate):
+    FUNCTION = 'MIN'
+
+class MAX(Aggregate):
+    FUNCTION = 'MAX'
+
 
 #Comparator
 
@@ -103,15 +215,26 @@ class Comparator(BaseComparator):
     def ge(cls, name, value) -> 'Comparator':
         return cls(name, '>=', value)
     
-    def make_query(self) -> str:
-        return "{} {} {}".format(self.name, self.op, self.value)
+    def compile_shape(self, params: list) -> Hashable:
+        if self.value is None and self.op in ['==', '=', '!=']:
+            return ('CMP', self.name, self.op, None) # Compiles to IS (NOT) NULL, since NULL never equals anything
+        params.append(self.value)
+        return ('CMP', self.name, self.op)
+    
+    def make_sql(self) -> str:
+        if self.value is None and self.op in ['==', '=', '!=']:
+            return "{} IS {}NULL".format(self.name, 'NOT ' if self.op == '!=' else '')
+        return "{} {} ?".format(self.name, self.op)
 
 
 class OrderBy(Statement):
     def __init__(self, orderers: List[Tuple[str, Literal['ASC', 'DESC']]]):
         self.orderers = orderers
 
-    def make_query(self) -> str:
+    def compile_shape(self, params: list) -> Hashable:
+        return ('ORDER BY',) + tuple(tuple(e) for e in self.orderers)
+    
+    def make_sql(self) -> str:
         return "ORDER BY {}".format(", ".join(["{} {}".format(*e) for e in self.orderers]))
 
 
@@ -120,8 +243,12 @@ class Limit(Statement):
         self.row_count = row_count
         self.offset = offset
 
-    def make_query(self) -> str:
-        return "LIMIT {},{}".format(self.offset, self.row_count)
+    def compile_shape(self, params: list) -> Hashable:
+        params.extend([self.offset, self.row_count])
+        return ('LIMIT',)
+    
+    def make_sql(self) -> str:
+        return "LIMIT ?,?"
 
 
 class Query(Statement):
@@ -129,11 +256,19 @@ class Query(Statement):
 
 
 class SelectQuery(Query):
-    def __init__(self, table_name: str, comparator: Union[Comparator, NoneType] = None, orderby: Union[OrderBy, NoneType] = None, limit: Union[Limit, NoneType] = None):
+    """
+    SELECT of columns, * if None. Columns are names, Fields or statements such as aggregates and EXISTS, 
+    groupby is a list of column names and having filters the groups. A query with no table_name selects its columns only.
+    """
+    def __init__(self, table_name: Union[str, NoneType], comparator: Union[Comparator, NoneType] = None, orderby: Union[OrderBy, NoneType] = None, limit: Union[Limit, NoneType] = None, 
+                 columns: Union[List[Any], NoneType] = None, groupby: Union[List[Any], NoneType] = None, having: Union[Statement, NoneType] = None):
         self.table_name = table_name
         self.comparator = comparator
         self.orderby = orderby
         self.limit = limit
+        self.columns = [column if isinstance(column, Statement) else getattr(column, 'name', column) for column in columns] if columns else None
+        self.groupby = [getattr(column, 'name', column) for column in groupby] if groupby else None
+        self.having = having
 
     def where(self, comparator: Comparator) -> 'SelectQuery':
         if self.comparator is None:
@@ -152,17 +287,35 @@ class SelectQuery(Query):
         else:
             self.orderby.column_order_pair.extend(additional_orderby_pairs)
         return self
-
-    def make_query(self) -> str:
-        s = "SELECT * FROM {}".format(self.table_name)
+    
+    @staticmethod
+    def make_column_sql(column: Any) -> str:
+        if not isinstance(column, Statement):
+            return column
+        sql = '({})'.format(column.make_sql()) if isinstance(column, Query) else column.make_sql()
+        return '{} AS {}'.format(sql, column.alias) if getattr(column, 'alias', None) is not None else sql
+
+    def compile_shape(self, params: list) -> Hashable:
+        columns_shape = tuple((column.compile_shape(params), getattr(column, 'alias', None)) if isinstance(column, Statement) else column for column in self.columns) if self.columns is not None else None
+        statements_shape = tuple(statement.compile_shape(params) if statement is not None else None for statement in [self.comparator, self.having, self.orderby, self.limit])
+        return ('SELECT', self.table_name, columns_shape, tuple(self.groupby) if self.groupby is not None else None) + statements_shape
+
+    def make_sql(self) -> str:
+        s = "SELECT {}".format(", ".join(map(self.make_column_sql, self.columns)) if self.columns is not None else '*')
+        if self.table_name is not None:
+            s += " FROM {}".format(self.table_name)
         if self.comparator is not None:
             # the spaces are intentional for spacing
-            s += ' WHERE ' + self.comparator.make_query()
+            s += ' WHERE ' + self.comparator.make_sql()
+        if self.groupby is not None:
+            s += ' GROUP BY ' + ", ".join(self.groupby)
+        if self.having is not None:
+            s += ' HAVING ' + self.having.make_sql()
         if self.orderby is not None:
-            s += ' ' + self.orderby.make_query()
+            s += ' ' + self.orderby.make_sql()
         if self.limit is not None:
-            s += ' ' + self.limit.make_query()
+            s += ' ' + self.limit.make_sql()
         return s
 
     def execute(self, database) -> List[dict]:
-        return database._select(self.make_query())
+        return database._select(*self.compile())
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from threading import Lock
+from typing import Callable, Dict, List, Union
+from urllib.parse import quote
+
+from .pragmas import resolve_pragmas
+
+
+class ReaderPool:
+    """
+    A pool of read-only connections to a database file, each connection is used by one thread at a time.
+    
+    Readers only run in parallel with the writer if the database is in WAL journal mode, the journal mode is left to the writer.
+    """
+    def __init__(self, database: str, size: int = 4, pragmas: Union[str, Dict[str, Union[str, int]], None] = None, row_factory: Callable = None, connect_kwargs: dict = None):
+        self.database = database
+        self.size = size
+        self.pragmas = {name: value for name, value in resolve_pragmas(pragmas).items() if name != 'journal_mode'}
+        self.row_factory = row_factory
+        self.connect_kwargs = connect_kwargs if connect_kwargs is not None else {}
+        
+        self._idle: LifoQueue = LifoQueue()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = Lock()
+    
+    def __repr__(self):
+        return "<{} object for database={} size={} open={}>".format(self.__class__.__name__, self.database, self.size, len(self._connections))
+    
+    @staticmethod
+    def supports(database: str) -> bool:
+        "In-memory databases can not be shared between connections."
+        return database != ':memory:' and not database.startswith('file::memory:') and database != ''
+    
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect('file:{}?mode=ro'.format(quote(os.path.abspath(self.database))), uri=True, check_same_thread=False, **self.connect_kwargs)
+        connection.row_factory = self.row_factory
+        for name, value in self.pragmas.items():
+            connection.execute("PRAGMA {}={}".format(name, value))
+        return connection
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Takes an idle connection, opens a new one while the pool is not full, else blocks until one is released."""
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            if len(self._connections) < self.size:
+                connection = self._connect()
+                self._connections.append(connection)
+                return connection
+        return self._idle.get()
+    
+    def release(self, connection: sqlite3.Connection):
+        self._idle.put(connection)
+    
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+    
+    def close(self):
+        with self._lock:
+            [connection.close() for connection in self._connections]
+            self._connections.clear()
+        self._idle = LifoQueue()
@@ -0,0 +1,36 @@
+import sqlite3
+from typing import Dict, Union
+
+
+PRAGMA_PRESETS: Dict[str, Dict[str, Union[str, int]]] = {
+    # Every commit survives a power loss, WAL keeps readers from blocking the writer.
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'FULL'},
+    # No fsyncs at all, an OS crash or power loss may corrupt the database. Meant for rebuildable bulk imports.
+    'fast-ingest': {'journal_mode': 'WAL', 'synchronous': 'OFF', 'temp_store': 'MEMORY', 'cache_size': -64*1024, 'wal_autocheckpoint': 10000},
+    # Commits survive a crash of the process but not necessarily a power loss, reads are served from memory mapped pages.
+    'read-heavy': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'temp_store': 'MEMORY', 'cache_size': -64*1024, 'mmap_size': 256*1024*1024},
+}
+
+
+def resolve_pragmas(pragmas: Union[str, Dict[str, Union[str, int]], None]) -> Dict[str, Union[str, int]]:
+    """Resolves a preset name from PRAGMA_PRESETS or a dictionary of pragmas into a dictionary of pragmas."""
+    if pragmas is None:
+        return {}
+    if isinstance(pragmas, str):
+        try:
+            return PRAGMA_PRESETS[pragmas].copy()
+        except KeyError:
+            raise KeyError("Unknown pragma preset '{}', available presets are {}.".format(pragmas, list(PRAGMA_PRESETS.keys())))
+    return dict(pragmas)
+
+
+def apply_pragmas(connection: sqlite3.Connection, pragmas: Union[str, Dict[str, Union[str, int]], None]) -> sqlite3.Connection:
+    """Applies pragmas to connection. Must be called before any transaction is opened, journal_mode can not be changed inside one."""
+    for name, value in resolve_pragmas(pragmas).items():
+        connection.execute("PRAGMA {}={}".format(name, value))
+    return connection
+
+
+def connect(database: str, pragmas: Union[str, Dict[str, Union[str, int]], None] = None, **connect_kwargs) -> sqlite3.Connection:
+    """sqlite3.connect with pragmas applied."""
+    return apply_pragmas(sqlite3.connect(database, **connect_kwargs), pragmas)
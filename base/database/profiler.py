@@ -0,0 +1,229 @@
+import re
+import sqlite3
+import time
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .models.base import ModelMeta
+from .models.datatypes import Index
+
+
+class QueryStats:
+    """Timings of one query shape, the SQL with ? placeholders, over its executions."""
+    SAMPLES = 1000 # Most recent durations kept for percentiles
+    TRANSACTION_CONTROL_PATTERN = re.compile(r'^\s*(?:BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+    
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.transaction_control = self.TRANSACTION_CONTROL_PATTERN.match(sql) is not None # Such as the savepoints of group commits
+        self.count = 0
+        self.total = 0.0
+        self.durations: Deque[float] = deque(maxlen=self.SAMPLES)
+        self.plan: Optional[List[str]] = None # EXPLAIN QUERY PLAN details, taken once the query is slow
+        self.full_scans: List[str] = [] # Tables scanned without an index according to the plan
+    
+    def __repr__(self):
+        return "<{} count={} total={:.6f} p95={:.6f} sql={!r}>".format(self.__class__.__name__, self.count, self.total, self.p95, self.sql)
+    
+    @property
+    def mean(self) -> float:
+        return self.total/self.count if self.count > 0 else 0.0
+    
+    def percentile(self, fraction: float) -> float:
+        durations = sorted(self.durations)
+        return durations[min(len(durations)-1, int(fraction*len(durations)))] if len(durations) > 0 else 0.0
+    
+    @property
+    def p95(self) -> float:
+        return self.percentile(0.95)
+
+
+class QueryProfiler:
+    """
+    Times every statement run on the connections it is passed to, see SQLiteDB(profiler=...). A statement's duration includes
+    fetching its rows. Statements slower than slow_threshold seconds have their query plan explained once, full table scans
+    in it are flagged and get_missing_indexes suggests indexes for them.
+    """
+    SCAN_PATTERN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+    COLUMN_PATTERN = re.compile(r'(?:"?\w+"?\.)?"?(\w+)"? (==|=|!=|<>|<=|>=|<|>|IS\b|LIKE\b|GLOB\b|IN\b|BETWEEN\b)', re.IGNORECASE)
+    
+    def __init__(self, slow_threshold: float = 0.05):
+        self.slow_threshold = slow_threshold
+        self.stats: Dict[str, QueryStats] = {}
+        self._lock = Lock()
+        self.connection_factory = type('ProfilingConnection', (ProfilingConnection,), dict(profiler=self))
+    
+    def __repr__(self):
+        return "<{} object slow_threshold={} shapes={}>".format(self.__class__.__name__, self.slow_threshold, len(self.stats))
+    
+    def record(self, connection: sqlite3.Connection, sql: str, parameters, duration: float):
+        with self._lock:
+            stats = self.stats.get(sql)
+            if stats is None:
+                stats = self.stats[sql] = QueryStats(sql)
+            stats.count += 1
+            stats.total += duration
+            stats.durations.append(duration)
+            explain = duration >= self.slow_threshold and stats.plan is None and not stats.transaction_control
+        if explain:
+            self.explain(connection, stats, parameters)
+    
+    def explain(self, connection: sqlite3.Connection, stats: QueryStats, parameters):
+        if parameters is None: # executemany, whose parameters are consumed
+            stats.plan = []
+            return
+        cursor = sqlite3.Connection.cursor(connection, sqlite3.Cursor) # Not profiled
+        cursor.row_factory = None
+        try:
+            plan = [row[3] for row in cursor.execute("EXPLAIN QUERY PLAN " + stats.sql, parameters)]
+        except sqlite3.Error as exc:
+            plan = ['EXPLAIN QUERY PLAN failed: {}'.format(exc)]
+        finally:
+            cursor.close()
+        stats.full_scans = [match.group(1) for match in map(self.SCAN_PATTERN.match, plan) if match is not None]
+        stats.plan = plan
+    
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+    
+    def get_stats(self, order_by: str = 'total', transaction_control: bool = False) -> List[QueryStats]:
+        """Stats of the queries, or of the transaction control statements such as BEGIN and SAVEPOINT if transaction_control."""
+        with self._lock:
+            return sorted((stats for stats in self.stats.values() if stats.transaction_control == transaction_control), key=lambda stats: getattr(stats, order_by), reverse=True)
+    
+    def get_slow_queries(self) -> List[QueryStats]:
+        return [stats for stats in self.get_stats() if stats.plan is not None]
+    
+    @staticmethod
+    def get_indexed_columns(model: ModelMeta) -> set:
+        """Columns leading an index of the model, by which rows are found without a scan."""
+        columns = {field.name for field in model.__FIELDS__.values() if field.opts.get('PRIMARY KEY', False) or field.opts.get('UNIQUE', False)}
+        columns.update(index.columns[0][0] if isinstance(index.columns[0], tuple) else index.columns[0] for index in model.__INDEXES__ if len(index.columns) > 0)
+        return columns
+    
+    def get_missing_indexes(self, tables: List[ModelMeta]) -> List[Tuple[ModelMeta, Index, QueryStats]]:
+        """
+        Indexes for the slow queries scanning a table of tables, on the columns the query filters by, equality comparisons first.
+        None is suggested if the first of those columns already leads an index, as an index can not help then.
+        """
+        models = {model.table_name.lower(): model for model in tables}
+        suggestions: Dict[Tuple[str, Tuple[str, ...]], Tuple[ModelMeta, Index, QueryStats]] = {}
+        for stats in self.get_slow_queries():
+            for table in stats.full_scans:
+                model = models.get(table.lower())
+                if model is None:
+                    continue
+                field_names = {field.name for field in model.__FIELDS__.values()}
+                where = re.split(r'\bWHERE\b', stats.sql, maxsplit=1, flags=re.IGNORECASE)[-1] if re.search(r'\bWHERE\b', stats.sql, re.IGNORECASE) else ''
+                comparisons = [(column, op.upper()) for column, op in self.COLUMN_PATTERN.findall(where) if column in field_names]
+                columns = list(dict.fromkeys([column for column, op in comparisons if op in ['==', '=', 'IS', 'IN']] + [column for column, _ in comparisons]))
+                if len(columns) == 0 or columns[0] in self.get_indexed_columns(model):
+                    continue
+                suggestions.setdefault((model.table_name, tuple(columns)), (model, Index(*columns), stats))
+        return list(suggestions.values())
+    
+    def report(self, tables: List[ModelMeta] = None, limit: int = 20) -> str:
+        """
+        Text report of the query shapes taking the most time, their full scans and the indexes missing for tables. 
+        Transaction control statements are listed apart, so commits and savepoints do not crowd out the queries.
+        """
+        header = "{:>8} {:>12} {:>10} {:>10}  {}".format('count', 'total (ms)', 'mean (ms)', 'p95 (ms)', 'query')
+        make_line = lambda stats: "{:>8} {:>12.3f} {:>10.3f} {:>10.3f}  {}{}".format(stats.count, stats.total*1000, stats.mean*1000, stats.p95*1000, stats.sql,
+                                                                                  '  [FULL SCAN: {}]'.format(', '.join(stats.full_scans)) if stats.full_scans else '')
+        lines = [header] + [make_line(stats) for stats in self.get_stats()[:limit]]
+        transaction_control = self.get_stats(transaction_control=True)
+        if len(transaction_control) > 0:
+            lines.append('')
+            lines.append('Transaction control:')
+            lines.extend(make_line(stats) for stats in transaction_control[:limit])
+        missing_indexes = self.get_missing_indexes(tables) if tables is not None else []
+        if len(missing_indexes) > 0:
+            lines.append('')
+            lines.append('Missing indexes:')
+            lines.extend('{};  -- {}'.format(index.make_create_query(model), stats.sql) for model, index, stats in missing_indexes)
+        return '\n'.join(lines)
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """A cursor reporting the duration of its statements to the connection's profiler, once their rows are fetched."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statement: Optional[list] = None # [sql, parameters, duration so far]
+    
+    def finish(self):
+        if self._statement is not None:
+            sql, parameters, duration = self._statement
+            self._statement = None
+            self.connection.profiler.record(self.connection, sql, parameters, duration)
+    
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[2] += time.perf_counter() - start
+    
+    def execute(self, sql, parameters=()):
+        self.finish()
+        self._statement = [sql, parameters, 0.0]
+        try:
+            self._timed(super().execute, sql, parameters)
+        except BaseException:
+            self.finish()
+            raise
+        if self.description is None: # No rows to fetch
+            self.finish()
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        self.finish()
+        self._statement = [sql, None, 0.0]
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self.finish()
+        return self
+    
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        self.finish() if row is None else None
+        return row
+    
+    def fetchmany(self, size=None):
+        size = size if size is not None else self.arraysize
+        rows = self._timed(super().fetchmany, size)
+        self.finish() if len(rows) < size else None
+        return rows
+    
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self.finish()
+        return rows
+    
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self.finish()
+            raise
+    
+    def close(self):
+        self.finish()
+        return super().close()
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Connection whose cursors are ProfilingCursors, made per profiler by QueryProfiler."""
+    profiler: QueryProfiler = None
+    
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -2,7 +2,7 @@
 from .base import BasePlugin, PluggableMixin
 
 from .cookies_manager import CookiesCachingMethod, CookiesManager
-from .download_manager import DownloadFileHandler, DownloadManager
+from .download_manager import BandwidthLimiter, DownloadCache, DownloadCancelled, DownloadFileHandler, DownloadManager, DownloadQueue, DownloadTask
 
 CookiesMan=CookiesManager
 DownloadMan=DownloadManager
@@ -1,7 +1,12 @@
 import json
+import os
 import pickle
+import sqlite3
+import threading
 from enum import Enum
+from typing import Dict, Tuple
 
+import requests.cookies
 import requests.utils
 
 from .base import BasePlugin
@@ -16,18 +21,26 @@ class CookiesCachingMethod(Enum):
     STRING = 'STRING'
     TXT = 'TXT'
     TEXT = 'TEXT'
+    SQLITE = 'SQLITE'
 
 
 class CookiesManager(BasePlugin):
     DEFAULT_COOKIES_CACHING_METHOD = CookiesCachingMethod.JSON
+    COOKIE_ATTRS = ["version", "name", "value", "port", "domain", "path", "secure",
+                    "expires", "discard", "comment", "comment_url", "rfc2109"]
     _repr_format = "<%(classname)s DEFAULT_COOKIES_CACHING_METHOD=%(DEFAULT_COOKIES_CACHING_METHOD)s>" # Format of __repr__
     
     REQUIRED_CONFIGS = dict(cookies_caching_method=DEFAULT_COOKIES_CACHING_METHOD, 
                             cached_cookies_filename='.cached', 
                             data_passthrough={})
     
+    # Parsed cookie files shared by every CookiesManager in the process, keyed by (method, filename) and validated by the file's inode, mtime and size.
+    _LOADED_JARS: Dict[Tuple[CookiesCachingMethod, str], Tuple[tuple, requests.cookies.RequestsCookieJar]] = {}
+    _LOADED_JARS_LOCK = threading.Lock()
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._snapshots: Dict[str, dict] = {} # Jar snapshots per filename, as of their last load or dump
     
     def __cookies_resolve_filename(self, method, filename=None):
         method = CookiesCachingMethod(method if method is not None else self.config.cookies_caching_method)
@@ -35,58 +48,144 @@ class CookiesManager(BasePlugin):
         filename = filename+'.'+method.getExtension() if not filename.lower().__contains__(method.getExtension().lower()) else filename
         return filename
     
+    def make_snapshot(self, cookies=None) -> Dict[tuple, tuple]:
+        """Snapshot of the cookie jar's content, used for dirty tracking."""
+        cookies = self.api.session.cookies if cookies is None else cookies
+        return {(cookie.domain, cookie.path, cookie.name): tuple(getattr(cookie, attr) for attr in self.COOKIE_ATTRS) for cookie in cookies}
+    
+    def is_dirty(self, method=None, filename=None) -> bool:
+        """Whether the cookie jar has changed since the file was last loaded or dumped by this manager."""
+        filename = self.__cookies_resolve_filename(method=method, filename=filename)
+        return self._snapshots.get(filename) != self.make_snapshot()
+    
+    @staticmethod
+    def write_atomically(filename, mode, writer):
+        """Calls writer with a temporary file, which then replaces filename. Readers in other processes never see a partially written file."""
+        temporary_filename = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.get_ident())
+        try:
+            with open(temporary_filename, mode) as f:
+                writer(f)
+            os.replace(temporary_filename, filename)
+        except BaseException:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            raise
+    
+    @staticmethod
+    def connect_sqlite(filename) -> sqlite3.Connection:
+        connection = sqlite3.connect(filename, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL") # Readers in other processes are not blocked by a dump
+        connection.execute("""CREATE TABLE IF NOT EXISTS cookies(version INTEGER, name TEXT, value TEXT, port TEXT, domain TEXT, path TEXT, secure INTEGER,
+                              expires INTEGER, discard INTEGER, comment TEXT, comment_url TEXT, rfc2109 INTEGER, PRIMARY KEY(domain, path, name))""")
+        return connection
+    
+    @staticmethod
+    def get_file_version(method: CookiesCachingMethod, filename) -> tuple:
+        """Changes whenever the file is rewritten, for SQLITE the write-ahead log is taken into account too."""
+        filenames = [filename, filename+'-wal'] if method == CookiesCachingMethod.SQLITE else [filename]
+        stats = [os.stat(_filename) for _filename in filenames if _filename == filename or os.path.exists(_filename)]
+        return tuple((stat.st_ino, stat.st_mtime_ns, stat.st_size) for stat in stats)
+    
     def load_cookies_from_string(self, cookies_string):
         cookies_entries = [entry.strip().split('=', 1) for entry in cookies_string.split(";") if entry.__contains__('=')]
         cookies = requests.utils.cookiejar_from_dict({k:v for k,v in cookies_entries})
         self.api.session.cookies.update(cookies)
     
-    def load_cookies(self, method=None, filename=None):
-        method = CookiesCachingMethod(method if method is not None else self.config.cookies_caching_method)
-        filename = self.__cookies_resolve_filename(method=method, filename=filename)
-        
-        # print('lc: ', filename, method)
+    def read_cookies(self, method: CookiesCachingMethod, filename) -> requests.cookies.RequestsCookieJar:
+        """Parses a cookies file into a new cookie jar."""
+        jar = requests.cookies.RequestsCookieJar()
         if method == CookiesCachingMethod.JSON:
             with open(filename, 'r') as f:
                 for entry in json.load(f):
-                    self.api.session.cookies.set(**entry)
+                    jar.set_cookie(requests.cookies.create_cookie(**entry))
         
         elif method == CookiesCachingMethod.SIMPLE_JSON:
             with open(filename, 'r') as f:
-                cookies = requests.utils.cookiejar_from_dict(json.load(f))
-                self.api.session.cookies.update(cookies)
+                requests.utils.cookiejar_from_dict(json.load(f), cookiejar=jar)
         
         elif method in [CookiesCachingMethod.TEXT, CookiesCachingMethod.TXT]:
             with open(filename, 'r') as f:
-                self.load_cookies_from_string(f.read())
-        
-        elif method == CookiesCachingMethod.STRING:
-            self.load_cookies_from_string(self.config.data_passthrough.get('cookies_string',''))
+                cookies_entries = [entry.strip().split('=', 1) for entry in f.read().split(";") if entry.__contains__('=')]
+                requests.utils.cookiejar_from_dict({k:v for k,v in cookies_entries}, cookiejar=jar)
         
         elif method == CookiesCachingMethod.PICKLE:
             with open(filename, 'rb') as f:
-                self.api.session.cookies.update(pickle.load(f))
-        # print('done')
+                jar.update(pickle.load(f))
+        
+        elif method == CookiesCachingMethod.SQLITE:
+            if not os.path.exists(filename):
+                raise FileNotFoundError("No such file: '{}'".format(filename))
+            connection = self.connect_sqlite(filename)
+            try:
+                for row in connection.execute("SELECT {} FROM cookies".format(", ".join(self.COOKIE_ATTRS))):
+                    entry = dict(zip(self.COOKIE_ATTRS, row))
+                    entry.update(secure=bool(entry['secure']), discard=bool(entry['discard']), rfc2109=bool(entry['rfc2109']))
+                    jar.set_cookie(requests.cookies.create_cookie(**entry))
+            finally:
+                connection.close()
+        return jar
+    
+    def load_cookies(self, method=None, filename=None):
+        method = CookiesCachingMethod(method if method is not None else self.config.cookies_caching_method)
+        filename = self.__cookies_resolve_filename(method=method, filename=filename)
+        
+        if method == CookiesCachingMethod.STRING:
+            self.load_cookies_from_string(self.config.data_passthrough.get('cookies_string',''))
+            return
+        
+        # A file is only parsed again once it is changed, by this or any other process.
+        version = self.get_file_version(method, filename)
+        cache_key = (method, os.path.abspath(filename))
+        with self._LOADED_JARS_LOCK:
+            cached_version, jar = self._LOADED_JARS.get(cache_key, (None, None))
+        if cached_version != version:
+            jar = self.read_cookies(method, filename)
+            with self._LOADED_JARS_LOCK:
+                self._LOADED_JARS[cache_key] = (version, jar)
+        
+        was_empty = len(self.api.session.cookies) == 0
+        self.api.session.cookies.update(jar)
+        if was_empty:
+            self._snapshots[filename] = self.make_snapshot()
     
-    def dump_cookies(self, method=None, filename=None):
+    def dump_cookies(self, method=None, filename=None, force=False) -> bool:
+        """Dumps the cookie jar, skipped if it has not changed since it was last loaded or dumped unless forced. Returns whether the file is written."""
         method = CookiesCachingMethod(method if method is not None else self.config.cookies_caching_method)
         filename = self.__cookies_resolve_filename(method=method, filename=filename)
-        # print('dc: ', filename, method)
+        snapshot = self.make_snapshot()
+        previous_snapshot = self._snapshots.get(filename)
+        if not force and previous_snapshot == snapshot:
+            return False
+        
         if method == CookiesCachingMethod.JSON:
-            cookie_attrs = ["version", "name", "value", "port", "domain", "path", "secure",
-                            "expires", "discard", "comment", "comment_url", "rfc2109"]
-            with open(filename, 'w') as f:
-                json.dump([{attr: getattr(cookie, attr) for attr in cookie_attrs} for cookie in self.api.session.cookies], f, indent=4)
+            self.write_atomically(filename, 'w', lambda f: json.dump([dict(zip(self.COOKIE_ATTRS, values)) for values in snapshot.values()], f, separators=(',', ':')))
         
         elif method == CookiesCachingMethod.SIMPLE_JSON:
-            with open(filename, 'w') as f:
-                json.dump(requests.utils.dict_from_cookiejar(self.api.session.cookies), f)
+            self.write_atomically(filename, 'w', lambda f: json.dump(requests.utils.dict_from_cookiejar(self.api.session.cookies), f))
         
         elif method in [CookiesCachingMethod.TEXT, CookiesCachingMethod.TXT]:
-            with open(filename, 'w') as f:
-                cookies_entries = requests.utils.dict_from_cookiejar(self.api.session.cookies)
-                f.write("; ".join(["{}={}".format(k,v) for k,v in cookies_entries.items()]))
+            cookies_entries = requests.utils.dict_from_cookiejar(self.api.session.cookies)
+            self.write_atomically(filename, 'w', lambda f: f.write("; ".join(["{}={}".format(k,v) for k,v in cookies_entries.items()])))
         
         elif method == CookiesCachingMethod.PICKLE:
-            with open(filename, 'wb') as f:
-                pickle.dump(self.api.session.cookies, f, pickle.HIGHEST_PROTOCOL)
-        # print("done")
+            self.write_atomically(filename, 'wb', lambda f: pickle.dump(self.api.session.cookies, f, pickle.HIGHEST_PROTOCOL))
+        
+        elif method == CookiesCachingMethod.SQLITE:
+            # Only changed cookies are written, the whole table is only rewritten on the first dump.
+            connection = self.connect_sqlite(filename)
+            try:
+                with connection:
+                    if previous_snapshot is None or force:
+                        connection.execute("DELETE FROM cookies")
+                        previous_snapshot = {}
+                    removed = [key for key in previous_snapshot if key not in snapshot]
+                    changed = [values for key, values in snapshot.items() if previous_snapshot.get(key) != values]
+                    connection.executemany("DELETE FROM cookies WHERE domain=? AND path=? AND name=?", removed)
+                    connection.executemany("INSERT OR REPLACE INTO cookies({}) VALUES ({})".format(", ".join(self.COOKIE_ATTRS), ", ".join('?'*len(self.COOKIE_ATTRS))), changed)
+            finally:
+                connection.close()
+        else:
+            return False
+        
+        self._snapshots[filename] = snapshot
+        return True
@@ -1,11 +1,33 @@
+import hashlib
+import heapq
+import itertools
+import json
+import logging
 import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
 
 from .base import BasePlugin
-from ..data_structs import ProgressInfo, Timer
+from ..data_structs import ObjectifiedDict, ProgressInfo, Timer
 from ..helper.class_mixin import ReprMixin
 from ..helper.snippets import metric_size_formatter, make_progress_bar, dict_updater
 
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
 class DownloadFileHandler(ReprMixin):
     TEMPORARY_DIR = 'temp'
     TEMPORARY_EXTENSION = 'tmp'
@@ -42,6 +64,11 @@ class DownloadFileHandler(ReprMixin):
     def finalize(self):
         self.temp_handler.flush()
         self.temp_handler.close()
+        try:
+            os.replace(self.temporary_filename, self.filename) # Cheap rename when both are on the same filesystem
+            return
+        except OSError:
+            pass
         with open(self.temporary_filename, 'rb') as src_file:
             with open(self.filename, 'wb') as dest_file:
                 while True:
@@ -56,16 +83,242 @@ class DownloadFileHandler(ReprMixin):
         os.remove(self.temporary_filename)
 
 
+class DownloadCache(ReprMixin):
+    """
+    Content-addressed store of finished downloads, objects are named by their digest and indexed by the download's url.
+    
+    Cached copies are placed with the first working LINK_METHODS, reflinks (copy-on-write clones) before plain copies. Hardlinks
+    are opt-in through link_methods, as a hardlinked download is the cached object itself, so editing it edits the store. Objects
+    are made read-only, and lookups verify their digest instead of only their size while hardlinks are enabled.
+    If revalidate is True, the server is asked with the stored ETag or Last-Modified before a cached copy is used, else cached 
+    copies are used without any request. Copies stored without either validator can not be revalidated and are always used.
+    
+    New entries are appended to an index log, which is merged into the index file every INDEX_COMPACT_ENTRIES entries. Both are 
+    written under a file lock, so processes sharing the directory do not lose each other's entries.
+    """
+    INDEX_FILENAME = 'index.json'
+    INDEX_LOG_FILENAME = 'index.log'
+    LOCK_FILENAME = 'index.lock'
+    INDEX_COMPACT_ENTRIES = 1000 # Entries appended to the index log before it is merged into the index file
+    OBJECTS_DIR = 'objects'
+    LINK_METHODS = ('reflink', 'copy') # 'hardlink' may be added, see the class docstring
+    FICLONE = 0x40049409 # Linux ioctl request number for reflinks
+    _repr_format = "<%(classname)s directory=%(directory)s hash_algorithm=%(hash_algorithm)s entries=%(len(self.index))s>" # Format of __repr__
+    
+    def __init__(self, directory: str = '.download_cache', hash_algorithm: str = 'sha256', revalidate: bool = True, link_methods: Iterable[str] = LINK_METHODS):
+        self.directory = directory
+        self.hash_algorithm = hash_algorithm
+        self.revalidate = revalidate
+        self.link_methods = tuple(link_methods)
+        self.lock = threading.RLock()
+        self.index: Dict[str, dict] = {}
+        self._log_entries = 0 # Entries appended to the index log since it was last merged
+        self._lock_file = None # The open lock file while index_lock is held
+        
+        os.makedirs(os.path.join(self.directory, self.OBJECTS_DIR, self.hash_algorithm), exist_ok=True)
+        self.load_index()
+    
+    @property
+    def index_filename(self) -> str:
+        return os.path.join(self.directory, self.INDEX_FILENAME)
+    
+    @property
+    def index_log_filename(self) -> str:
+        return os.path.join(self.directory, self.INDEX_LOG_FILENAME)
+    
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, self.OBJECTS_DIR, self.hash_algorithm, digest)
+    
+    @contextmanager
+    def index_lock(self):
+        """Locks the index files against other threads, and against other processes where fcntl is available."""
+        with self.lock:
+            if self._lock_file is not None: # Already held by this thread
+                yield
+                return
+            with open(os.path.join(self.directory, self.LOCK_FILENAME), 'a') as self._lock_file:
+                try:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX) if fcntl is not None else None
+                    yield # Closing the lock file releases the lock
+                finally:
+                    self._lock_file = None
+    
+    def read_index(self) -> Dict[str, dict]:
+        """The index file with the index log replayed on it, a line cut off by a crash is skipped."""
+        try:
+            with open(self.index_filename, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        try:
+            with open(self.index_log_filename, 'r') as f:
+                for line in f:
+                    try:
+                        key, entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    index[key] = entry
+        except FileNotFoundError:
+            pass
+        return index
+    
+    def load_index(self):
+        with self.index_lock():
+            self.index = self.read_index()
+    
+    def dump_index(self):
+        """Merges the index log into the index file, which is replaced atomically. Entries of other processes are kept."""
+        with self.index_lock():
+            self.index = self.read_index()
+            temporary_filename = '{}.{}.{}.tmp'.format(self.index_filename, os.getpid(), threading.get_ident())
+            with open(temporary_filename, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(temporary_filename, self.index_filename)
+            open(self.index_log_filename, 'w').close()
+            self._log_entries = 0
+    
+    def lookup(self, key: str) -> Optional[dict]:
+        """Returns the entry of key if its object is still intact in the store."""
+        with self.lock:
+            entry = self.index.get(key)
+        if entry is None:
+            return None
+        object_path = self.object_path(entry['digest'])
+        try:
+            if os.path.getsize(object_path) == entry['size'] and ('hardlink' not in self.link_methods or self.file_digest(object_path) == entry['digest']):
+                return entry
+        except OSError:
+            pass
+        return None
+    
+    def file_digest(self, filename: str) -> str:
+        hasher = hashlib.new(self.hash_algorithm)
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
+    def store(self, key: str, filename: str, digest: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> dict:
+        """Adds a finished download to the store, content which is already stored is not duplicated. Only its entry is written to the index log."""
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            self.link(filename, object_path)
+            os.chmod(object_path, 0o444)
+        entry = dict(digest=digest, etag=etag, last_modified=last_modified, size=os.path.getsize(object_path))
+        with self.index_lock():
+            with open(self.index_log_filename, 'a') as f:
+                f.write(json.dumps([key, entry])+'\n')
+            self.index[key] = entry
+            self._log_entries += 1
+            self.dump_index() if self._log_entries >= self.INDEX_COMPACT_ENTRIES else None
+        return entry
+    
+    @staticmethod
+    def make_validator_headers(entry: dict) -> Dict[str, str]:
+        """Conditional request headers revalidating a cached entry, empty if the server sent no validator for it."""
+        headers = {}
+        headers.update({'If-None-Match': entry['etag']}) if entry.get('etag') is not None else None
+        headers.update({'If-Modified-Since': entry['last_modified']}) if entry.get('last_modified') is not None else None
+        return headers
+    
+    def restore(self, entry: dict, filename: str) -> str:
+        """Places the cached object of entry at filename, returns the link method used."""
+        return self.link(self.object_path(entry['digest']), filename)
+    
+    def link(self, source: str, destination: str) -> str:
+        """Links source to destination with the first working link method, replacing destination atomically."""
+        temporary_filename = '{}.{}.tmp'.format(destination, threading.get_ident())
+        for method in self.link_methods:
+            try:
+                if method == 'reflink':
+                    if fcntl is None:
+                        continue
+                    with open(source, 'rb') as src_file, open(temporary_filename, 'wb') as dest_file:
+                        fcntl.ioctl(dest_file.fileno(), self.FICLONE, src_file.fileno())
+                elif method == 'hardlink':
+                    os.link(source, temporary_filename)
+                else:
+                    shutil.copyfile(source, temporary_filename)
+                os.replace(temporary_filename, destination)
+                return method
+            except OSError:
+                try:
+                    os.remove(temporary_filename)
+                except OSError:
+                    pass
+        raise OSError("Could not link '{}' to '{}' with any of {}.".format(source, destination, self.link_methods))
+
+
+class BandwidthLimiter(ReprMixin):
+    """
+    Thread-safe token bucket on bytes, shared by every download it is passed to.
+    
+    consume may take more tokens than available, the debt is paid by sleeping. rate can be changed at any time, None or 0 disables the limit.
+    """
+    _repr_format = "<%(classname)s rate=%(rate)s burst=%(burst)s>" # Format of __repr__
+    
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None):
+        self._condition = threading.Condition()
+        self._rate = rate
+        self._burst = burst
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+    
+    @property
+    def rate(self) -> Optional[float]:
+        return self._rate
+    
+    @rate.setter
+    def rate(self, rate: Optional[float]):
+        with self._condition:
+            self._refill()
+            self._rate = rate
+            self._tokens = min(self._tokens, self.burst)
+            self._condition.notify_all() # Sleeping consumers recompute their wait with the new rate
+    
+    @property
+    def burst(self) -> float:
+        "Bucket capacity, defaults to a second worth of tokens."
+        return self._burst if self._burst is not None else (self._rate or 0)
+    
+    def _refill(self):
+        now = time.monotonic()
+        if self._rate:
+            self._tokens = min(self._tokens + (now-self._last_refill)*self._rate, self.burst)
+        self._last_refill = now
+    
+    def consume(self, amount: int):
+        """Takes amount tokens from the bucket, blocking until the bucket is out of debt."""
+        with self._condition:
+            if not self._rate:
+                return
+            self._refill()
+            self._tokens -= amount
+            while self._rate and self._tokens < 0:
+                self._condition.wait(-self._tokens/self._rate)
+                self._refill()
+
+
 class DownloadManager(BasePlugin):
-    DOWNLOAD_CHUNK_SIZE = 512
+    DOWNLOAD_CHUNK_SIZE = 64*1024 # Initial chunk size, adapted to the measured throughput if ADAPTIVE_CHUNK_SIZE is enabled
+    DOWNLOAD_CHUNK_SIZE_MIN = 4*1024
+    DOWNLOAD_CHUNK_SIZE_MAX = 4*1024*1024
+    ADAPTIVE_CHUNK_SIZE = True
+    ADAPTIVE_CHUNK_TARGET_DURATION = 0.05 # Seconds worth of throughput a single chunk should hold
+    DOWNLOAD_BANDWIDTH_LIMIT = None # Global limit in bytes per second for all downloads of a manager, None for unlimited
+    DOWNLOAD_HASH_ALGORITHM = 'sha256' # Any hashlib algorithm, computed while downloading. None to disable
     _repr_format = "<%(classname)s DOWNLOAD_CHUNK_SIZE=%(DOWNLOAD_CHUNK_SIZE)s session_kwargs=%(session_kwargs)s>" # Format of __repr__
     
-    REQUIRED_CONFIGS = dict(download_progress_bar_length=int(__import__('os').get_terminal_size().columns * (5/8)))
+    REQUIRED_CONFIGS = dict(download_progress_bar_length=int(shutil.get_terminal_size().columns * (5/8)), 
+                            progress_hook_interval=0.1, # Minimum seconds between progress hook calls, 0 to disable
+                            progress_hook_byte_interval=0) # Minimum bytes between progress hook calls, 0 to disable
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         self.session_kwargs = {'stream':True}
+        self.bandwidth_limiter = BandwidthLimiter(self.DOWNLOAD_BANDWIDTH_LIMIT)
+        self.download_cache: Optional[DownloadCache] = None
         
         self.predownload_hooks = []
         self.progress_hooks = []
@@ -89,6 +342,66 @@ class DownloadManager(BasePlugin):
         self.finished_hooks.append(hook)
         return self
     
+    def next_chunk_size(self, chunk_size: int, chunk_length: int, chunk_duration: float) -> int:
+        """Resizes the chunk size so a single chunk holds about ADAPTIVE_CHUNK_TARGET_DURATION seconds of the measured throughput."""
+        if not self.ADAPTIVE_CHUNK_SIZE or chunk_duration <= 0 or chunk_length < chunk_size:
+            return chunk_size
+        target_size = chunk_length/chunk_duration*self.ADAPTIVE_CHUNK_TARGET_DURATION
+        # Grow or shrink by at most a factor of 2 per chunk, to not overreact to a single slow or fast read.
+        target_size = min(max(target_size, chunk_size/2), chunk_size*2)
+        return int(min(max(target_size, self.DOWNLOAD_CHUNK_SIZE_MIN), self.DOWNLOAD_CHUNK_SIZE_MAX))
+    
+    def iter_chunks(self, stream, limiters: List['BandwidthLimiter'] = ()):
+        """Yields chunks from the stream, adapting the chunk size to the measured throughput and throttling to the given limiters."""
+        chunk_size = self.DOWNLOAD_CHUNK_SIZE
+        if not self.ADAPTIVE_CHUNK_SIZE or not hasattr(stream.raw, 'read'):
+            for chunk in stream.iter_content(chunk_size):
+                [limiter.consume(len(chunk)) for limiter in limiters]
+                yield chunk
+            return
+        while True:
+            # Keeps chunks small enough for throttled downloads to stay smooth instead of bursty.
+            rates = [limiter.rate for limiter in limiters if limiter.rate]
+            read_size = min(chunk_size, max(int(min(rates)*self.ADAPTIVE_CHUNK_TARGET_DURATION), self.DOWNLOAD_CHUNK_SIZE_MIN)) if rates else chunk_size
+            chunk_start = time.perf_counter()
+            chunk = stream.raw.read(read_size, decode_content=True)
+            if not chunk:
+                break
+            chunk_duration = time.perf_counter()-chunk_start
+            [limiter.consume(len(chunk)) for limiter in limiters]
+            yield chunk
+            if read_size == chunk_size:
+                chunk_size = self.next_chunk_size(chunk_size, len(chunk), chunk_duration)
+    
+    def make_limiters(self, bandwidth_limit: Union[int, float, 'BandwidthLimiter', Iterable['BandwidthLimiter'], None]) -> List['BandwidthLimiter']:
+        """Combines the manager's global limiter with the per-download bandwidth_limit, which is either bytes per second, a limiter or a list of limiters."""
+        if bandwidth_limit is None:
+            limiters = []
+        elif isinstance(bandwidth_limit, BandwidthLimiter):
+            limiters = [bandwidth_limit]
+        elif isinstance(bandwidth_limit, (int, float)):
+            limiters = [BandwidthLimiter(bandwidth_limit)]
+        else:
+            limiters = [limiter for limiter in bandwidth_limit if limiter is not None]
+        return [self.bandwidth_limiter] + limiters
+    
+    def set_bandwidth_limit(self, rate: Optional[float]):
+        """Sets the global bandwidth limit in bytes per second, shared by every download of this manager. Takes effect on running downloads."""
+        self.bandwidth_limiter.rate = rate
+        return self
+    
+    def run_progress_hooks(self, prog_info: ProgressInfo, force=False, hooks: List = None):
+        """Runs progress hooks, or hooks if given, at most once every progress_hook_interval seconds or progress_hook_byte_interval bytes, unless forced."""
+        position = prog_info.pipe_handler.tell()
+        last_time, last_position = prog_info.get('last_progress_hook_call', (None, 0))
+        current_time = prog_info.time_info.current_time
+        if not force and last_time is not None:
+            time_interval, byte_interval = self.config.progress_hook_interval, self.config.progress_hook_byte_interval
+            if not ((time_interval and current_time-last_time >= time_interval) or (byte_interval and position-last_position >= byte_interval)):
+                return
+        prog_info.last_progress_hook_call = (current_time, position)
+        [hook(prog_info) for hook in (hooks if hooks is not None else self.progress_hooks)]
+    
     def default_predownload_hook(self, progress: ProgressInfo):
         progress.content_length = int(progress.stream.headers['Content-Length'])
     
@@ -101,25 +414,319 @@ class DownloadManager(BasePlugin):
     def default_finished_hook(self, progress: ProgressInfo):
         print("Downloaded file in %ds" % round(progress.time_info.duration, 2))
     
-    def download_to_file(self, filename, *session_args, retry_download=True, progress_info_updater=None, **session_kwargs):
+    def use_cache(self, cache: Union['DownloadCache', str] = '.download_cache', **cache_kwargs):
+        """Enables the content-addressed download cache, either a DownloadCache or a directory for a new one. None disables it."""
+        self.download_cache = DownloadCache(cache, **cache_kwargs) if isinstance(cache, str) else cache
+        return self
+    
+    def make_cache_key(self, *session_args, **session_kwargs) -> str:
+        """The cache key of a download, the full url with its params."""
+        url = session_kwargs.get('url', session_args[0] if len(session_args) > 0 else None)
+        return requests.Request('GET', url, params=session_kwargs.get('params')).prepare().url
+    
+    def download_to_file(self, filename, *session_args, retry_download=True, progress_info_updater=None, run_hooks=True, cancel_event: threading.Event = None, bandwidth_limit=None, 
+                         hash_algorithm: Optional[str] = None, use_cache=True, progress_hook=None, **session_kwargs):
+        """
+        Downloads to filename. Hooks are skipped if run_hooks is False, and the download is aborted with DownloadCancelled once cancel_event is set.
+        progress_hook is called like the progress hooks and throttled with them, even if run_hooks is False.
+        bandwidth_limit caps this download on top of the manager's global limit, see make_limiters.
+        
+        The content is hashed with hash_algorithm (defaults to DOWNLOAD_HASH_ALGORITHM) while it is written, the hex digest is stored as digest in the returned ProgressInfo.
+        If a download cache is set and use_cache is True, a cached copy is linked to filename instead of transferring it again, in which case from_cache is True.
+        """
         timer = Timer().start()
+        limiters = self.make_limiters(bandwidth_limit)
         session_kwargs = dict_updater(self.session_kwargs, session_kwargs)
+        predownload_hooks, finished_hooks = (self.predownload_hooks, self.finished_hooks) if run_hooks else ([], [])
+        progress_hooks = (self.progress_hooks if run_hooks else []) + ([progress_hook] if progress_hook is not None else [])
         
-        with self.session.get(*session_args, **session_kwargs) as stream, DownloadFileHandler(filename) as file_handler:
-            prog_info = ProgressInfo(stream=stream, pipe_handler=file_handler, time_info=timer)
-            prog_info.update(progress_info_updater) if progress_info_updater is not None else None
-            [hook(prog_info) for hook in self.predownload_hooks]
-            for chunk in stream.iter_content(self.DOWNLOAD_CHUNK_SIZE):
-                if not chunk:
-                    break
-                file_handler.write(chunk)
-
-                timer.update_current()
-                [hook(prog_info) for hook in self.progress_hooks]
-            timer.end()
-        [hook(prog_info) for hook in self.finished_hooks]
+        cache = self.download_cache if use_cache else None
+        hash_algorithm = hash_algorithm or (cache.hash_algorithm if cache is not None else self.DOWNLOAD_HASH_ALGORITHM)
+        cache_key = self.make_cache_key(*session_args, **session_kwargs) if cache is not None else None
+        cache_entry = cache.lookup(cache_key) if cache is not None and cache.hash_algorithm == hash_algorithm else None
+        validator_headers = cache.make_validator_headers(cache_entry) if cache_entry is not None else {}
+        if cache_entry is not None and (not cache.revalidate or len(validator_headers) == 0):
+            cache.restore(cache_entry, filename)
+            prog_info = ProgressInfo(stream=None, pipe_handler=None, time_info=timer.end())
+            prog_info.update(dict(from_cache=True, digest=cache_entry['digest'], downloaded_bytes=0))
+            [hook(prog_info) for hook in finished_hooks]
+            return prog_info
+        if cache_entry is not None:
+            session_kwargs['headers'] = dict_updater(session_kwargs.get('headers') or {}, validator_headers)
+        
+        with self.session.get(*session_args, **session_kwargs) as stream:
+            if cache_entry is not None and stream.status_code == 304:
+                cache.restore(cache_entry, filename)
+                prog_info = ProgressInfo(stream=stream, pipe_handler=None, time_info=timer.end())
+                prog_info.update(dict(from_cache=True, digest=cache_entry['digest'], downloaded_bytes=0))
+                [hook(prog_info) for hook in finished_hooks]
+                return prog_info
+            
+            with DownloadFileHandler(filename) as file_handler:
+                hasher = hashlib.new(hash_algorithm) if hash_algorithm is not None else None
+                prog_info = ProgressInfo(stream=stream, pipe_handler=file_handler, time_info=timer)
+                prog_info.update(progress_info_updater) if progress_info_updater is not None else None
+                [hook(prog_info) for hook in predownload_hooks]
+                for chunk in self.iter_chunks(stream, limiters):
+                    if not chunk:
+                        break
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise DownloadCancelled("Download to '{}' is cancelled.".format(filename))
+                    file_handler.write(chunk)
+                    hasher.update(chunk) if hasher is not None else None
+                    
+                    timer.update_current()
+                    self.run_progress_hooks(prog_info, hooks=progress_hooks) if progress_hooks else None
+                if progress_hooks and prog_info.get('last_progress_hook_call', (None, 0))[1] != file_handler.tell():
+                    self.run_progress_hooks(prog_info, force=True, hooks=progress_hooks) # Always report the final state
+                prog_info.update(dict(downloaded_bytes=file_handler.tell(), from_cache=False, 
+                                      hash_algorithm=hash_algorithm, digest=hasher.hexdigest() if hasher is not None else None))
+                timer.end()
+        [hook(prog_info) for hook in finished_hooks]
         
         if stream.ok:
+            if cache is not None:
+                cache.store(cache_key, filename, prog_info.digest, etag=stream.headers.get('ETag'), last_modified=stream.headers.get('Last-Modified'))
             return prog_info
         if retry_download:
-            return self.download_to_file(filename, *session_args, retry_download=retry_download, **session_kwargs)
+            return self.download_to_file(filename, *session_args, retry_download=retry_download, run_hooks=run_hooks, cancel_event=cancel_event, bandwidth_limit=limiters[1:], 
+                                         hash_algorithm=hash_algorithm, use_cache=use_cache, progress_hook=progress_hook, **session_kwargs)
+    
+    def make_queue(self, *args, **kwargs) -> 'DownloadQueue':
+        """Shorthand for DownloadQueue(self, *args, **kwargs)"""
+        return DownloadQueue(self, *args, **kwargs)
+
+
+class DownloadCancelled(RuntimeError):
+    """A download is cancelled before it is finished."""
+
+
+class DownloadTask(ReprMixin):
+    """A queued download, blocks on get_result until the download is finished, failed or cancelled."""
+    _repr_format = "<%(classname)s filename=%(filename)s priority=%(priority)s done=%(done)s cancelled=%(cancelled)s>" # Format of __repr__
+    
+    def __init__(self, filename: str, session_args: tuple, session_kwargs: dict, priority: int = 0):
+        self.filename = filename
+        self.session_args = session_args
+        self.session_kwargs = session_kwargs
+        self.priority = priority
+        self.host = urlparse(session_kwargs.get('url', session_args[0] if len(session_args) > 0 else '')).netloc
+        
+        self.result: ProgressInfo = None
+        self.exception: BaseException = None
+        self.downloaded_bytes = 0 # Written so far while running
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+    
+    @property
+    def done(self) -> bool:
+        return self.done_event.is_set()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+    
+    @property
+    def ok(self) -> bool:
+        return self.done and self.exception is None and bool(self.result)
+    
+    def cancel(self):
+        """Cancels the task, a pending task is skipped and a running one is aborted on its next chunk."""
+        self.cancel_event.set()
+    
+    def get_result(self, block=True, timeout=None) -> ProgressInfo:
+        """Waits for the task to finish, then returns its ProgressInfo or raises its exception."""
+        if not self.done_event.wait(timeout if block else 0):
+            raise TimeoutError("Download to '{}' is not finished yet.".format(self.filename))
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+class DownloadQueue(ReprMixin):
+    """
+    Downloads queued files with a pool of worker threads through a DownloadManager.
+    
+    Lower priority values are downloaded first, at most per_host_limit downloads run against a single host at once, 
+    and queueing a filename which is already pending or running returns the existing task instead.
+    """
+    _repr_format = "<%(classname)s workers=%(workers)s per_host_limit=%(per_host_limit)s pending=%(pending)s active=%(active)s>" # Format of __repr__
+    
+    def __init__(self, download_manager: DownloadManager, workers: int = 4, per_host_limit: int = 2, *, bandwidth_limit: Optional[float] = None, run_download_hooks: bool = False, initialize: bool = True, **default_session_kwargs):
+        self.download_manager = download_manager
+        self.bandwidth_limiter = BandwidthLimiter(bandwidth_limit) # Shared by every task of the queue
+        self.workers = workers
+        self.per_host_limit = per_host_limit
+        self.run_download_hooks = run_download_hooks
+        self.default_session_kwargs = dict_updater({'retry_download': False}, default_session_kwargs)
+        
+        self.progress_hooks = []
+        self.finished_hooks = []
+        
+        self._condition = threading.Condition()
+        self._host_queues: Dict[str, List[Tuple[int, int, DownloadTask]]] = {}
+        self._active_per_host: Dict[str, int] = {}
+        self._targets: Dict[str, DownloadTask] = {}
+        self._sequence = itertools.count()
+        self._closed = False
+        self._threads: List[threading.Thread] = []
+        self.stats = dict(total=0, finished=0, failed=0, cancelled=0, downloaded_bytes=0)
+        self._active_bytes = 0 # Bytes written so far by the running tasks
+        
+        if initialize:
+            self._init()
+    
+    def _init(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.process_queued_tasks, name='DownloadQueue Worker Thread #{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    @property
+    def pending(self) -> int:
+        return sum(len(host_queue) for host_queue in self._host_queues.values())
+    
+    @property
+    def active(self) -> int:
+        return sum(self._active_per_host.values())
+    
+    def register_prog_hook(self, hook):
+        """
+        Hook is called with the queue's progress after every finished, failed or cancelled task, and while tasks download, 
+        as often as the manager's progress hooks (see DownloadManager.run_progress_hooks) for each of them.
+        """
+        self.progress_hooks.append(hook)
+        return self
+    
+    def register_finished_hook(self, hook):
+        """Hook is called with the queue's progress whenever the queue runs out of tasks."""
+        self.finished_hooks.append(hook)
+        return self
+    
+    def put(self, filename, *session_args, priority: int = 0, **session_kwargs) -> DownloadTask:
+        """Queues a download, arguments are the same as DownloadManager.download_to_file."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Can not queue a download on a closed DownloadQueue.")
+            target = os.path.abspath(filename)
+            if target in self._targets:
+                return self._targets[target]
+            task = DownloadTask(filename, session_args, dict_updater(self.default_session_kwargs, session_kwargs), priority=priority)
+            self._targets[target] = task
+            heapq.heappush(self._host_queues.setdefault(task.host, []), (priority, next(self._sequence), task))
+            self.stats['total'] += 1
+            self._condition.notify()
+        return task
+    
+    def _pop_runnable_task(self) -> Optional[DownloadTask]:
+        "Pops the highest priority task from hosts which are not at their limit. Must be called with the condition acquired."
+        best_host = None
+        for host, host_queue in self._host_queues.items():
+            if len(host_queue) == 0 or self._active_per_host.get(host, 0) >= self.per_host_limit:
+                continue
+            if best_host is None or host_queue[0] < self._host_queues[best_host][0]:
+                best_host = host
+        if best_host is None:
+            return None
+        return heapq.heappop(self._host_queues[best_host])[2]
+    
+    def process_queued_tasks(self):
+        while True:
+            with self._condition:
+                task = self._pop_runnable_task()
+                while task is None:
+                    if self._closed and self.pending == 0:
+                        return
+                    self._condition.wait()
+                    task = self._pop_runnable_task()
+                self._active_per_host[task.host] = self._active_per_host.get(task.host, 0) + 1
+            
+            if task.cancelled:
+                task.exception = DownloadCancelled("Download to '{}' is cancelled.".format(task.filename))
+            else:
+                try:
+                    session_kwargs = task.session_kwargs.copy()
+                    bandwidth_limit = self.download_manager.make_limiters(session_kwargs.pop('bandwidth_limit', None))[1:]
+                    task.result = self.download_manager.download_to_file(task.filename, *task.session_args, run_hooks=self.run_download_hooks, cancel_event=task.cancel_event, 
+                                                                         bandwidth_limit=[self.bandwidth_limiter]+bandwidth_limit, 
+                                                                         progress_hook=lambda prog_info, task=task: self._task_progressed(task, prog_info), **session_kwargs)
+                except BaseException as exc:
+                    task.exception = exc
+            self._finish_task(task)
+    
+    def _task_progressed(self, task: DownloadTask, prog_info: ProgressInfo):
+        "Progress hook of a running task, runs the queue's progress hooks with its bytes counted in."
+        with self._condition:
+            position = prog_info.pipe_handler.tell()
+            self._active_bytes += position - task.downloaded_bytes
+            task.downloaded_bytes = position
+            progress = self.get_progress()
+        self.run_hooks(self.progress_hooks, progress)
+    
+    def _finish_task(self, task: DownloadTask):
+        with self._condition:
+            self._active_per_host[task.host] -= 1
+            self._active_bytes -= task.downloaded_bytes
+            self._targets.pop(os.path.abspath(task.filename), None)
+            if task.cancelled:
+                self.stats['cancelled'] += 1
+            elif task.exception is not None or not task.result:
+                self.stats['failed'] += 1
+            else:
+                self.stats['finished'] += 1
+                self.stats['downloaded_bytes'] += task.result.downloaded_bytes
+            task.done_event.set()
+            progress = self.get_progress()
+            self._condition.notify_all()
+        
+        self.run_hooks(self.progress_hooks, progress)
+        if progress.pending == 0 and progress.active == 0:
+            self.run_hooks(self.finished_hooks, progress)
+    
+    @staticmethod
+    def run_hooks(hooks, progress: ObjectifiedDict):
+        "Runs hooks on a worker thread, a failing hook is logged so it can not take the worker down with it."
+        for hook in hooks:
+            try:
+                hook(progress)
+            except Exception:
+                logger.exception("DownloadQueue hook %r failed.", hook)
+    
+    def set_bandwidth_limit(self, rate: Optional[float]):
+        """Sets the bandwidth limit in bytes per second shared by all tasks of this queue. Takes effect on running downloads."""
+        self.bandwidth_limiter.rate = rate
+        return self
+    
+    def get_progress(self) -> ObjectifiedDict:
+        """
+        Aggregated progress of the queue, with total, finished, failed, cancelled, downloaded_bytes, pending and active entries. 
+        downloaded_bytes counts the finished tasks, active_bytes the bytes written so far by the running ones.
+        """
+        with self._condition:
+            return ObjectifiedDict(self.stats, pending=self.pending, active=self.active, active_bytes=self._active_bytes)
+    
+    def cancel(self):
+        """Cancels every pending and running task."""
+        with self._condition:
+            for task in self._targets.values():
+                task.cancel()
+    
+    def join(self, timeout=None) -> bool:
+        """Blocks until every queued task is done, returns False if timed out."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.pending == 0 and self.active == 0, timeout=timeout)
+    
+    def close(self, wait=True, cancel=False):
+        """Stops accepting tasks, the workers exit once the queue is drained."""
+        self.cancel() if cancel else None
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            [thread.join() for thread in self._threads]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close(wait=True, cancel=exc_type is not None)
@@ -0,0 +1,61 @@
+"""
+Benchmarks of the database layer on a write and read mix, run with: python benchmark.py [rows]
+
+Each benchmark creates its databases in a temporary directory, so results depend on the filesystem of the temporary directory.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from base.database import SQLiteDB, PRAGMA_PRESETS, Model, Field
+
+
+class BenchmarkEntry(Model):
+    entry_id = Field(int, primary_key=True, not_null=True, unique=True)
+    group_id = Field(int, not_null=True)
+    name = Field(str, not_null=True)
+    value = Field(float, not_null=True)
+
+
+def make_entries(start, stop):
+    return [BenchmarkEntry(entry_id=i, group_id=i%100, name='entry #{}'.format(i), value=random.random()) for i in range(start, stop)]
+
+
+def timed(func, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter()-start
+
+
+def benchmark_pragmas(rows: int = 5000):
+    """Single row commits, one batched insert, primary key lookups and full scans for every pragma preset."""
+    print("{:<12} {:>14} {:>14} {:>14} {:>14}".format('preset', 'single (r/s)', 'batch (r/s)', 'lookup (q/s)', 'scan (r/s)'))
+    single_rows, lookups = max(rows//10, 1), max(rows//10, 1)
+    for preset in [None]+list(PRAGMA_PRESETS.keys()):
+        with tempfile.TemporaryDirectory() as directory:
+            class BenchmarkDB(SQLiteDB):
+                TABLES = [BenchmarkEntry]
+                REGISTER_AS_MODEL_DB = False
+                PRAGMAS = preset
+            db = BenchmarkDB(os.path.join(directory, 'benchmark.sqlite3'))
+            
+            single_entries, batch_entries = make_entries(0, single_rows), make_entries(single_rows, rows)
+            single = timed(lambda: [db.insert(entry) for entry in single_entries])
+            batch = timed(db.insert_many, batch_entries)
+            lookup = timed(lambda: [list(db.get(BenchmarkEntry, BenchmarkEntry.entry_id == random.randrange(rows))) for _ in range(lookups)])
+            scan = timed(lambda: [list(db.get_all(BenchmarkEntry)) for _ in range(3)])
+            db.close()
+        
+        print("{:<12} {:>14.0f} {:>14.0f} {:>14.0f} {:>14.0f}".format(str(preset), single_rows/single, (rows-single_rows)/batch, lookups/lookup, 3*rows/scan))
+
+
+BENCHMARKS = [benchmark_pragmas]
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for benchmark in BENCHMARKS:
+        print("\n== {} ==".format(benchmark.__name__))
+        benchmark(rows)
@@ -42,10 +42,10 @@ class Beatmap(BaseOsuObject):
     REQUIRED_FIELDS = ['beatmap_id', 'beatmapset_id', 'approved', 'title', 'version', 'artist']
     # First type of implementation for Model
     beatmap_id = Field(int, primary_key=True, not_null=True, unique=True)
-    beatmapset_id = Field(int, not_null=True)
-    artist = Field(str, not_null=True)
+    beatmapset_id = Field(int, not_null=True, index=True)
+    artist = Field(str, not_null=True, fulltext=True)
     approved = Field(int, not_null=True)
-    title = Field(str, not_null=True)
+    title = Field(str, not_null=True, fulltext=True)
     version = Field(str, not_null=True)
     
     def __repr__(self):
@@ -0,0 +1,22 @@
+from array import array
+
+from base.database.columnar import ColumnBuffer
+
+
+def test_extend_promotes_mixed_batch_once():
+    buffer = ColumnBuffer('q')
+    buffer.extend((1, 2, 'x', 3))
+    assert list(buffer.values) == [1, 2, 'x', 3]
+
+
+def test_extend_promotes_overflowing_batch_once():
+    buffer = ColumnBuffer('q')
+    buffer.extend((1, 2))
+    buffer.extend((3, 2**70))
+    assert buffer.values == array('d', [1, 2, 3, 2**70])
+
+
+def test_extend_promotes_nulls_to_nan():
+    buffer = ColumnBuffer()
+    buffer.extend((1, None, 3))
+    assert buffer.typecode == 'd' and buffer.values[0] == 1 and buffer.values[1] != buffer.values[1] and len(buffer) == 3
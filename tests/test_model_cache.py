@@ -0,0 +1,42 @@
+import pytest
+
+from base.api.data_structs import BaseAPIObject
+from base.database import Field, SQLiteDB
+
+
+class Track(BaseAPIObject):
+    __TABLE_NAME__ = 'tracks'
+    track_id = Field(int, primary_key=True, not_null=True)
+    title = Field(str, not_null=True)
+
+
+class DB(SQLiteDB):
+    TABLES = [Track]
+    REGISTER_AS_MODEL_DB = False
+    MODEL_CACHE_SIZE = 16
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DB(str(tmp_path / 'tracks.db'))
+    db.insert(Track({'track_id': 1, 'title': 'a'}))
+    yield db
+    db.close()
+
+
+def get_track(db, track_id):
+    return next(db.get(Track, Track.track_id == track_id))
+
+
+def test_raw_write_invalidates_cached_instances(db):
+    assert get_track(db, 1)['title'] == 'a'
+    db.execute("UPDATE tracks SET title = 'b' WHERE track_id = 1")
+    assert get_track(db, 1)['title'] == 'b'
+
+
+def test_unsaved_changes_are_not_served(db):
+    obj = get_track(db, 1)
+    assert get_track(db, 1) is obj
+    obj.title = 'changed'
+    assert get_track(db, 1)['title'] == 'a'
+    assert get_track(db, 1) is not obj
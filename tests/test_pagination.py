@@ -0,0 +1,30 @@
+import pytest
+
+from base.database import SQLiteDB, Model, Field
+
+
+class Row(Model):
+    id = Field(int, primary_key=True)
+    a = Field(int)
+
+
+class DB(SQLiteDB):
+    TABLES = [Row]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DB(str(tmp_path / 'pages.db'))
+    # a is NULL for every other row, so pages end on NULL keys
+    db.insert_many(Row(id=i) if i % 2 == 0 else Row(id=i, a=i % 3) for i in range(1, 40))
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('order', ['ASC', 'DESC'])
+@pytest.mark.parametrize('page_size', [1, 2, 5, 100])
+def test_iter_pages_with_null_keys(db, order, page_size):
+    pages = list(db.iter_pages(Row, order_by=('a', order), page_size=page_size))
+    expected = [(row['id'], row['a']) for row in db.select('SELECT id, a FROM Row ORDER BY a {0}, id {0}'.format(order))]
+    assert [(obj.id, obj.to_dict().get('a')) for page in pages for obj in page] == expected
+    assert all(len(page) == page_size for page in pages[:-1])
@@ -0,0 +1,32 @@
+import pytest
+
+from base.api.data_structs import BaseAPIObject
+from base.database import Field, SQLiteDB
+
+
+class Song(BaseAPIObject):
+    # An API object, which inherits dict.values
+    __TABLE_NAME__ = 'songs'
+    song_id = Field(int, primary_key=True, not_null=True)
+    approved = Field(int, not_null=True)
+
+
+class DB(SQLiteDB):
+    TABLES = [Song]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DB(str(tmp_path / 'songs.db'))
+    db.insert_many(Song({'song_id': i, 'approved': i % 3 - 1}) for i in range(10))
+    yield db
+    db.close()
+
+
+def test_select_values_of_api_object(db):
+    assert sorted(Song.select_values('song_id', Song.approved > 0)) == [2, 5, 8]
+    assert sorted(Song.select_values(Song.song_id, Song.approved, Song.approved > 0)) == [(2, 1), (5, 1), (8, 1)]
+
+
+def test_api_object_keeps_dict_values(db):
+    assert list(Song({'song_id': 1, 'approved': 0}).values()) == [1, 0]
@@ -0,0 +1,37 @@
+import pytest
+
+from base.api.data_structs import BaseAPIObject
+from base.database import Field, ShardedSQLiteDB
+
+
+class Score(BaseAPIObject):
+    # Values are dictionary items, not attributes, like Beatmap and User
+    __TABLE_NAME__ = 'scores'
+    score_id = Field(int, primary_key=True, not_null=True)
+    points = Field(int)
+
+
+class DB(ShardedSQLiteDB):
+    TABLES = [Score]
+    SHARD_COUNT = 2
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DB(str(tmp_path / 'scores.db'))
+    db.insert_many(Score({'score_id': i, 'points': (i * 7) % 30}) for i in range(30))
+    db.flush()
+    yield db
+    db.close()
+
+
+def test_get_merges_shards_in_order(db):
+    points = [obj['points'] for obj in db.get(Score, orderby=('points', 'DESC'), limit=5)]
+    assert points == [29, 28, 27, 26, 25]
+
+
+@pytest.mark.parametrize('page_size', [1, 7, 100])
+def test_iter_pages_merges_shards_in_order(db, page_size):
+    pages = list(db.iter_pages(Score, order_by=('points', 'ASC'), page_size=page_size))
+    assert [obj['points'] for page in pages for obj in page] == list(range(30))
+    assert all(len(page) == page_size for page in pages[:-1])
@@ -0,0 +1,39 @@
+import threading
+
+import pytest
+
+from base.database import Field, Model, MultiThreadedSQLiteDB
+
+
+class Item(Model):
+    id = Field(int, primary_key=True)
+
+
+class DB(MultiThreadedSQLiteDB):
+    TABLES = [Item]
+    REGISTER_AS_MODEL_DB = False
+
+
+@pytest.mark.parametrize('reader_pool_size', [0, 2])
+def test_other_threads_do_not_read_uncommitted_writes(tmp_path, reader_pool_size):
+    db = DB(str(tmp_path / 'items.db'), reader_pool_size=reader_pool_size)
+    db.insert(Item(id=1))
+    written, counted = threading.Event(), []
+
+    def count():
+        written.wait()
+        counted.append(db.count(Item))
+        counted.append(len(list(db.get(Item))))
+
+    reader = threading.Thread(target=count)
+    reader.start()
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.insert(Item(id=2))
+            assert db.count(Item) == 2 # The transaction's thread sees its own writes
+            written.set()
+            reader.join(0.2)
+            raise RuntimeError('rollback')
+    reader.join()
+    assert counted == [1, 1]
+    db.close()